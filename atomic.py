@@ -0,0 +1,34 @@
+import contextlib
+import os
+import tempfile
+
+# The umask can only be read by setting it, done once here rather than from the threads that write files
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_mode(path):
+    # Mode a new file at path gets: the mode of the file it replaces, or what open() would have created
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w"):
+    # Yields a file to write path through. It is written under a temp name of its own in the same directory
+    # and renamed over path once complete, so readers never see half a file and processes writing the same
+    # path at once never write into each other's file. The temp file is removed if writing fails.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            # mkstemp makes the file owner-only, keep the mode of the file it replaces or the usual default
+            os.fchmod(f.fileno(), file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,284 @@
+import json
+import os
+import struct
+import subprocess
+from collections import namedtuple
+
+from atomic import atomic_write
+
+AudioInfo = namedtuple("AudioInfo", ["duration", "sample_rate", "channels"])
+
+# Probed metadata is cached per user, so repeat renders against the same track skip probing entirely
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                         "ball-video")
+CACHE_FILE = os.path.join(CACHE_DIR, "audio_info.json")
+MAX_CACHE_ENTRIES = 4096  # Oldest entries are dropped beyond this
+
+# MPEG audio header tables, indexed by version (1, 2 or 2.5) and layer
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_BITRATES[(2, 3)] = MP3_BITRATES[(2, 2)]
+MP3_MAX_SYNC_SEARCH = 1 << 16  # Bytes scanned for the first frame after the ID3 tag
+
+# MP4 boxes that only hold other boxes, on the way down to the audio track's headers
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+
+def read_wav(f):
+    # RIFF chunks: "fmt " has the format, the size of "data" gives the duration. Parsed by hand rather than
+    # with the wave module, which refuses float and extensible WAVs.
+    riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        return None
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHII", f.read(12))
+            f.seek(size - 12 + size % 2, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            _, channels, sample_rate, byte_rate = fmt
+            # Streamed WAVs leave the size unset, the data then runs to the end of the file
+            remaining = os.fstat(f.fileno()).st_size - f.tell()
+            if size == 0 or size == 0xFFFFFFFF or size > remaining:
+                size = remaining
+            return AudioInfo(size / byte_rate, sample_rate, channels)
+        else:
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def parse_mp3_header(header):
+    # (frame length in bytes, samples per frame, sample rate, channels), None if this isn't a frame header
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((header[1] >> 3) & 3)
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version is None or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    channels = 1 if header[3] >> 6 == 3 else 2
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, channels
+    samples = 576 if layer == 3 and version != 1 else 1152
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, channels
+
+
+def read_mp3(f):
+    data = f.read()
+    start = 0
+    # Skip any ID3v2 tags, their size is stored as a syncsafe integer
+    while data[start:start + 3] == b"ID3" and len(data) >= start + 10:
+        size = 0
+        for byte in data[start + 6:start + 10]:
+            size = (size << 7) | (byte & 0x7F)
+        start += 10 + size + (10 if data[start + 5] & 0x10 else 0)
+
+    # The first frame header is one whose successor is where it says it is
+    end = min(len(data), start + MP3_MAX_SYNC_SEARCH)
+    while start < end:
+        start = data.find(b"\xff", start, end)
+        if start < 0:
+            return None
+        frame = parse_mp3_header(data[start:start + 4])
+        if frame is not None and (start + frame[0] >= len(data) or
+                                  parse_mp3_header(data[start + frame[0]:start + frame[0] + 4]) is not None):
+            break
+        start += 1
+    else:
+        return None
+    length, samples, sample_rate, channels = frame
+
+    # VBR files carry the frame count in a Xing/Info or VBRI header inside the first frame
+    version_1 = (data[start + 1] >> 3) & 3 == 3
+    side_info = (32 if channels == 2 else 17) if version_1 else (17 if channels == 2 else 9)
+    xing = start + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        if flags & 1:
+            total = struct.unpack(">I", data[xing + 8:xing + 12])[0] * samples
+            # LAME's tag follows with the encoder delay and padding, which decoders trim for gapless playback
+            lame = xing + 8 + 4 * bin(flags & 0xB).count("1") + (100 if flags & 4 else 0)
+            if data[lame:lame + 4] in (b"LAME", b"Lavc", b"Lavf"):
+                delay_padding = int.from_bytes(data[lame + 21:lame + 24], "big")
+                total -= (delay_padding >> 12) + (delay_padding & 0xFFF)
+            return AudioInfo(total / sample_rate, sample_rate, channels)
+    if data[start + 36:start + 40] == b"VBRI":
+        return AudioInfo(struct.unpack(">I", data[start + 50:start + 54])[0] * samples / sample_rate, sample_rate,
+                         channels)
+
+    # Otherwise count the frames, hopping from header to header
+    frames = 0
+    position = start
+    while True:
+        frame = parse_mp3_header(data[position:position + 4])
+        if frame is None:
+            break
+        frames += 1
+        position += frame[0]
+    return AudioInfo(frames * samples / sample_rate, sample_rate, channels)
+
+
+def mp4_boxes(f, end):
+    # (type, payload start, payload end) for each box between the current position and end
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            return
+        yield box_type, f.tell(), start + size
+        f.seek(start + size)
+
+
+def read_mp4_boxes(f, end, boxes, path=()):
+    # Collects the payloads of the boxes needed for the duration, keyed by their path from the top level.
+    # Only the first audio track is kept.
+    for box_type, start, box_end in mp4_boxes(f, end):
+        box_path = path + (box_type,)
+        if box_type == b"trak":
+            track = {}
+            read_mp4_boxes(f, box_end, track, box_path)
+            if track.get(box_path + (b"mdia", b"hdlr"), b"")[8:12] == b"soun" and b"trak" not in boxes:
+                boxes.update(track)
+                boxes[b"trak"] = True
+        elif box_type in MP4_CONTAINERS:
+            read_mp4_boxes(f, box_end, boxes, box_path)
+        elif box_type in (b"mvhd", b"mdhd", b"hdlr", b"elst", b"stsd"):
+            boxes[box_path] = f.read(min(box_end - start, 256))
+        f.seek(box_end)
+
+
+def read_mp4(f):
+    f.seek(4)
+    if f.read(4) != b"ftyp":
+        return None
+    f.seek(0)
+    boxes = {}
+    read_mp4_boxes(f, os.fstat(f.fileno()).st_size, boxes)
+    if b"trak" not in boxes:
+        return None
+    track = (b"moov", b"trak", b"mdia")
+
+    def header_times(payload):
+        # (timescale, duration) from a version 0 or 1 mvhd/mdhd
+        if payload[0] == 1:
+            return struct.unpack(">IQ", payload[20:32])
+        return struct.unpack(">II", payload[12:20])
+
+    # The edit list trims the encoder's priming samples, when there is one it's the duration players use
+    movie_timescale = header_times(boxes[(b"moov", b"mvhd")])[0]
+    timescale, duration = header_times(boxes[track + (b"mdhd",)])
+    elst = boxes.get((b"moov", b"trak", b"edts", b"elst"))
+    if elst is not None:
+        version, count = elst[0], struct.unpack(">I", elst[4:8])[0]
+        entry = 12 if version == 0 else 20
+        fmt = ">I" if version == 0 else ">Q"
+        edits = [struct.unpack(fmt, elst[8 + i * entry:8 + i * entry + struct.calcsize(fmt)])[0]
+                 for i in range(count) if 8 + (i + 1) * entry <= len(elst)]
+        if edits:
+            timescale, duration = movie_timescale, sum(edits)
+
+    # The first sample entry (mp4a) holds the channel count and the sample rate as 16.16 fixed point
+    stsd = boxes[track + (b"minf", b"stbl", b"stsd")]
+    channels, _, _, _, sample_rate = struct.unpack(">HHHHI", stsd[8 + 8 + 16:8 + 8 + 28])
+    return AudioInfo(duration / timescale, sample_rate >> 16, channels)
+
+
+def read_ffprobe(path):
+    # Anything the readers above don't cover. JSON output with warnings kept off stdout, so a chatty
+    # ffprobe can't break the parsing.
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries",
+             "format=duration:stream=duration,sample_rate,channels", "-of", "json", path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise IOError("Couldn't read %s in process and ffprobe isn't available: %s" % (path, e))
+    try:
+        probed = json.loads(result.stdout)
+        stream = (probed.get("streams") or [{}])[0]
+        duration = probed.get("format", {}).get("duration") or stream.get("duration")
+        return AudioInfo(float(duration), int(stream.get("sample_rate", 0)), int(stream.get("channels", 0)))
+    except (ValueError, TypeError, IndexError, AttributeError):
+        raise IOError("Couldn't read the duration of %s:\n%s" % (path, result.stderr.decode(errors="replace")))
+
+
+def read_audio_info(path):
+    # In-process readers first, picked by the file's magic bytes, ffprobe for anything else
+    with open(path, "rb") as f:
+        magic = f.read(12)
+        f.seek(0)
+        if magic[:4] == b"RIFF":
+            reader = read_wav
+        elif magic[4:8] == b"ftyp":
+            reader = read_mp4
+        elif magic[:3] == b"ID3" or parse_mp3_header(magic[:4]) is not None:
+            reader = read_mp3
+        else:
+            reader = None
+        try:
+            info = reader(f) if reader is not None else None
+        except (struct.error, KeyError, ValueError, ZeroDivisionError):
+            info = None
+    if info is None or info.duration <= 0:
+        info = read_ffprobe(path)
+    return info
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with atomic_write(CACHE_FILE) as f:
+            json.dump(cache, f)
+    except OSError:
+        pass  # The cache is only an optimization
+
+
+def probe(path, use_cache=True):
+    # Duration, sample rate and channels of an audio file, cached by path, size and mtime
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cache = load_cache() if use_cache else {}
+    entry = cache.get(path)
+    if entry is not None and entry[:2] == key:
+        return AudioInfo(*entry[2])
+
+    info = read_audio_info(path)
+    if use_cache:
+        cache.pop(path, None)  # Re-inserted last, dicts keep insertion order so the oldest come first
+        cache[path] = key + [list(info)]
+        while len(cache) > MAX_CACHE_ENTRIES:
+            del cache[next(iter(cache))]
+        save_cache(cache)
+    return info
+
+
+def get_audio_duration(path):
+    return probe(path).duration
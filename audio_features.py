@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import math
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+from atomic import atomic_write
+from audio import CACHE_DIR, probe
+
+FEATURES_VERSION = 1  # Bump when the analysis changes, so stale cached tracks are recomputed
+ANALYSIS_RATE = 22050  # Sample rate ffmpeg decodes to for analysis
+WINDOW = 0.05  # Seconds per analysis window, centered on the frame's time
+NUM_BANDS = 8  # Log-spaced spectrum bands
+LOWEST_BAND = 40.0  # Hz
+HIGHEST_BAND = 11025.0  # Hz, or the Nyquist frequency if that's lower
+BLOCK_FRAMES = 1024  # Frames analysed per vectorized block, bounds the memory used on long tracks
+BEAT_AVERAGE = 0.5  # Seconds either side of a frame its onset strength is compared against
+BEAT_DELTA = 0.1  # How far the onset strength must rise above that average
+BEAT_MIN_GAP = 0.1  # Seconds, a beat must be the strongest onset within this distance
+
+FEATURE_DTYPE = np.dtype([
+    ("rms", np.float32),  # Loudness, 0 to 1 over the track
+    ("onset", np.float32),  # Spectral flux, how much new energy arrived, 0 to 1
+    ("beat", np.bool_),  # Peaks of the onset strength
+    ("spectrum", np.float32, (NUM_BANDS,)),  # Log band magnitudes, each band 0 to 1 over the track
+])
+
+
+def decode(path):
+    # Mono float32 samples and their rate. Plain PCM WAVs are read with the wave module, anything else is decoded
+    # once by an ffmpeg pipe.
+    try:
+        with wave.open(path) as w:
+            width = w.getsampwidth()
+            if width in (1, 2, 4):
+                data = np.frombuffer(w.readframes(w.getnframes()), {1: np.uint8, 2: np.int16, 4: np.int32}[width])
+                samples = data.reshape(-1, w.getnchannels()).mean(axis=1, dtype=np.float32)
+                if width == 1:
+                    return (samples - 128) / 128, w.getframerate()
+                return samples / (1 << (8 * width - 1)), w.getframerate()
+    except (wave.Error, EOFError):
+        pass
+
+    from encoder import get_ffmpeg_exe
+
+    result = subprocess.run([get_ffmpeg_exe(), "-v", "error", "-i", path, "-f", "f32le", "-ac", "1",
+                             "-ar", str(ANALYSIS_RATE), "-"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise IOError("ffmpeg couldn't decode %s:\n%s" % (path, result.stderr.decode(errors="replace")))
+    return np.frombuffer(result.stdout, np.float32), ANALYSIS_RATE
+
+
+def band_edges(sample_rate, window):
+    # rfft bin where each band starts, the last edge is where the last band ends
+    frequencies = np.geomspace(LOWEST_BAND, min(HIGHEST_BAND, sample_rate / 2), NUM_BANDS + 1)
+    return np.minimum(np.round(frequencies * window / sample_rate).astype(np.int64), window // 2)
+
+
+def analyse(samples, sample_rate, fps, num_frames):
+    # Per-frame features at the render FPS. Video frame k is shown at k / fps, its window is centered there.
+    features = np.zeros(num_frames, FEATURE_DTYPE)
+    window = int(round(WINDOW * sample_rate))
+    padded = np.concatenate([np.zeros(window // 2, np.float32), samples, np.zeros(window, np.float32)])
+    starts = np.minimum(np.round(np.arange(num_frames) * sample_rate / fps).astype(np.int64),
+                        len(padded) - window)
+    edges = band_edges(sample_rate, window)
+    hann = np.hanning(window).astype(np.float32)
+    offsets = np.arange(window)
+    previous = None
+    for block in range(0, num_frames, BLOCK_FRAMES):
+        windows = padded[starts[block:block + BLOCK_FRAMES, None] + offsets]
+        features["rms"][block:block + BLOCK_FRAMES] = np.sqrt(np.mean(windows * windows, axis=1))
+
+        magnitude = np.log1p(np.abs(np.fft.rfft(windows * hann, axis=1)))
+        # Band means from cumulative sums, so every band is one subtraction
+        totals = np.cumsum(magnitude, axis=1)
+        totals = np.concatenate([np.zeros((len(totals), 1)), totals], axis=1)
+        features["spectrum"][block:block + BLOCK_FRAMES] = \
+            (totals[:, edges[1:]] - totals[:, edges[:-1]]) / np.maximum(edges[1:] - edges[:-1], 1)
+
+        # Spectral flux: the increase in log magnitude from the previous frame, summed over the bins
+        previous = magnitude[:1] if previous is None else previous
+        flux = np.diff(np.concatenate([previous, magnitude]), axis=0)
+        features["onset"][block:block + BLOCK_FRAMES] = np.maximum(flux, 0).sum(axis=1)
+        previous = magnitude[-1:]
+
+    for name in ("rms", "spectrum"):
+        peak = features[name].max(axis=0)
+        features[name] /= np.where(peak > 0, peak, 1)
+    # Normalized to a high percentile rather than the maximum, so one transient doesn't flatten the rest
+    onset = features["onset"]
+    scale = np.percentile(onset, 99) if num_frames else 0
+    onset[:] = np.minimum(onset / scale, 1) if scale > 0 else 0
+    features["beat"] = pick_beats(onset, fps)
+    return features
+
+
+def moving_window(values, radius, fill):
+    # (len(values), 2 * radius + 1) view of the neighbourhood around each value
+    padded = np.concatenate([np.full(radius, fill, values.dtype), values, np.full(radius, fill, values.dtype)])
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1)
+
+
+def pick_beats(onset, fps):
+    # Beats are onset peaks that stand out from their surroundings and are the strongest nearby
+    if not len(onset):
+        return np.zeros(0, bool)
+    average = moving_window(onset, max(int(BEAT_AVERAGE * fps), 1), 0).mean(axis=1)
+    strongest = moving_window(onset, max(int(BEAT_MIN_GAP * fps / 2), 1), -1).max(axis=1)
+    return (onset >= strongest) & (onset > average + BEAT_DELTA)
+
+
+def cache_path(audio_path, fps):
+    # Next to the audio file, e.g. track.mp3.60fps.v1.npy, or in the user cache dir for read-only music folders
+    name = "%s.%gfps.v%d.npy" % (os.path.basename(audio_path), fps, FEATURES_VERSION)
+    directory = os.path.dirname(os.path.abspath(audio_path))
+    if os.access(directory, os.W_OK):
+        return os.path.join(directory, name)
+    digest = hashlib.sha1(os.path.realpath(audio_path).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, "features", "%s-%s" % (digest, name))
+
+
+def save_features(path, features):
+    with atomic_write(path, "wb") as f:
+        np.save(f, features)
+
+
+def load_features(audio_path, fps):
+    # Memory-mapped per-frame features of the track, analysed once and cached. Reading features[frame] is
+    # O(1) and only pages in what the render touches.
+    path = cache_path(audio_path, fps)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(audio_path):
+        samples, sample_rate = decode(audio_path)
+        num_frames = math.ceil(probe(audio_path).duration * fps)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_features(path, analyse(samples, sample_rate, fps, num_frames))
+    return np.load(path, mmap_mode="r")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse audio tracks ahead of audio-reactive renders")
+    parser.add_argument("audio", nargs="+", help="Audio files to analyse")
+    parser.add_argument("--fps", type=float, default=60, help="Frame rate of the render the features are for")
+    args = parser.parse_args(argv)
+
+    for audio_path in args.audio:
+        features = load_features(audio_path, args.fps)
+        print("%s: %d frames, %d beats, mean loudness %.2f"
+              % (audio_path, len(features), features["beat"].sum(), features["rms"].mean()))
+
+
+if __name__ == "__main__":
+    main()
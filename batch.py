@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from atomic import atomic_write
+from audio import get_audio_duration, read_audio_info
+from encoder import PROFILES
+from postfx import parse_effects
+from render import PREVIEW_SCALE, PREVIEW_SUFFIX, load_scene, render, scene_params
+from render_cache import render_cached
+
+OUTPUT_NAME = "{scene}_{audio}_{seed}{preview}.mp4"  # Default output of a job, in the manifest's output_dir
+JOB_KEYS = {"scene", "audio", "seed", "params", "output", "profile", "preview", "preview_fps"}
+JOB_MEMORY_MB = 1500  # Memory one job is budgeted, the render plus its encoder
+RETRIES = 2  # Extra attempts a failed job gets
+DURATION_TOLERANCE = 0.25  # Seconds an existing output may be off the soundtrack's length and still count as done
+
+
+def load_manifest(path):
+    # JSON, or YAML when PyYAML is installed
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() not in (".yaml", ".yml"):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Reading %s needs PyYAML (pip install pyyaml), or write the manifest as JSON" % path)
+        return yaml.safe_load(f)
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def default_seed(scene, audio, params):
+    # Stable across runs, so a job without a seed renders the same video and keeps its output name
+    return zlib.crc32(json.dumps([scene, os.path.basename(audio), params], sort_keys=True).encode())
+
+
+def expand_jobs(manifest, base_dir="."):
+    # One job per combination of the scenes, audio files and seeds an entry lists. Settings under "defaults"
+    # apply to every entry, an entry's params are merged over the default params.
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+    defaults = manifest.get("defaults", {})
+    output_dir = os.path.normpath(os.path.join(base_dir, manifest.get("output_dir", ".")))
+    jobs = []
+    for entry in manifest.get("jobs", []):
+        entry = {**defaults, **entry, "params": {**defaults.get("params", {}), **entry.get("params", {})}}
+        unknown = set(entry) - JOB_KEYS
+        if unknown:
+            raise ValueError("Unknown job setting %r, expected: %s"
+                             % (sorted(unknown)[0], ", ".join(sorted(JOB_KEYS))))
+        if "scene" not in entry or "audio" not in entry:
+            raise ValueError("Every job needs a scene and an audio file: %r" % entry)
+        for scene_name, audio, seed in itertools.product(as_list(entry["scene"]), as_list(entry["audio"]),
+                                                         as_list(entry.get("seed"))):
+            scene_class = load_scene(scene_name)
+            # Converted like --set values, an unknown parameter is an error
+            params = scene_params(scene_name, scene_class,
+                                  [("%s.%s" % (scene_name, key), str(value)) for key, value in entry["params"].items()])
+            parse_effects(params.get("effects", scene_class.effects))
+            audio = os.path.normpath(os.path.join(base_dir, audio))
+            if seed is None:
+                seed = default_seed(scene_name, audio, params)
+            profile = entry.get("profile")
+            if entry.get("preview"):
+                params.setdefault("scale", PREVIEW_SCALE)
+                profile = profile or "draft"
+            if profile is not None and profile not in PROFILES:
+                raise ValueError("Unknown encode profile %r, choose from: %s" % (profile, ", ".join(PROFILES)))
+            fields = {"scene": scene_name, "audio": os.path.splitext(os.path.basename(audio))[0], "seed": seed,
+                      "preview": PREVIEW_SUFFIX if entry.get("preview") else ""}
+            jobs.append({"scene": scene_name, "audio": audio, "seed": int(seed), "params": params, "profile": profile,
+                         "preview_fps": entry.get("preview_fps"),
+                         "output": os.path.join(output_dir, entry.get("output", OUTPUT_NAME).format(**fields))})
+
+    outputs = [job["output"] for job in jobs]
+    for output in outputs:
+        if outputs.count(output) > 1:
+            raise ValueError("Several jobs write %s, give them different outputs" % output)
+    return jobs
+
+
+def partial_path(output):
+    # Rendered here and renamed once complete, so an output that exists is never a crashed job's leftovers
+    root, ext = os.path.splitext(output)
+    return root + ".part" + ext
+
+
+def fingerprint_path(output):
+    # Sidecar recording what an output was rendered from, e.g. galaxy_track_42.mp4.job.json
+    return output + ".job.json"
+
+
+def job_fingerprint(job):
+    # Hash of everything a job's video depends on that its output name may not show, None if the audio is gone
+    try:
+        audio = os.stat(job["audio"])
+    except OSError:
+        return None
+    fps = job["params"].get("fps", load_scene(job["scene"]).fps)
+    settings = {"scene": job["scene"], "seed": job["seed"], "params": job["params"], "profile": job["profile"],
+                "preview_fps": job["preview_fps"], "fps": fps, "audio": [audio.st_mtime_ns, audio.st_size]}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_valid_output(job):
+    # A finished render of this very job: its fingerprint matches the sidecar written when it was rendered, and
+    # it is a readable MP4 whose soundtrack is as long as the audio
+    try:
+        with open(fingerprint_path(job["output"])) as f:
+            if json.load(f).get("fingerprint") != job_fingerprint(job):
+                return False
+        info = read_audio_info(job["output"])
+        return abs(info.duration - get_audio_duration(job["audio"])) <= DURATION_TOLERANCE
+    except (OSError, KeyError, ValueError, AttributeError):
+        return False
+
+
+def audio_duration(path):
+    # 0 for audio that can't be read, its job fails when it runs and the error lands in the summary
+    try:
+        return get_audio_duration(path)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def available_memory():
+    # Bytes the kernel says can be allocated without swapping, None where there's no /proc/meminfo
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def pool_size(jobs, job_memory_mb=JOB_MEMORY_MB):
+    # One job per core, as many as fit in memory, never more than there are jobs
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // (job_memory_mb * 1024 * 1024))
+    return max(min(workers, jobs), 1)
+
+
+def run_job(job, use_cache=False, threads=None):
+    # Runs in a worker process, renders one job with an encoder of `threads` threads and returns its frame count
+    # and wall time
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+    partial = partial_path(job["output"])
+    if use_cache:
+        frames = render_cached(job["scene"], job["audio"], output=partial, seed=job["seed"], params=job["params"],
+                               profile=job["profile"], preview_fps=job["preview_fps"], threads=threads)
+    else:
+        frames = render(job["scene"], job["audio"], output=partial, seed=job["seed"], params=job["params"],
+                        profile=job["profile"], preview_fps=job["preview_fps"], threads=threads)
+    os.replace(partial, job["output"])
+    with atomic_write(fingerprint_path(job["output"])) as f:
+        json.dump({"fingerprint": job_fingerprint(job)}, f)
+    return frames, time.perf_counter() - started
+
+
+def write_summary(path, results, started):
+    counts = {status: sum(result["status"] == status for result in results)
+              for status in ("rendered", "skipped", "failed", "pending")}
+    summary = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "wall_seconds": time.perf_counter() - started,
+               **counts, "jobs": results}
+    with atomic_write(path) as f:
+        json.dump(summary, f, indent=2)
+
+
+def run_batch(jobs, summary_path, workers=None, retries=RETRIES, force=False, job_memory_mb=JOB_MEMORY_MB,
+              use_cache=False):
+    # Renders the jobs in a pool of worker processes, longest soundtrack first so short jobs fill the gaps at
+    # the end. Jobs whose output is already a valid render are skipped. A failed job goes back in the queue
+    # until it has had retries more attempts. The summary is rewritten after every job.
+    started = time.perf_counter()
+    results = [{"scene": job["scene"], "audio": job["audio"], "seed": job["seed"], "params": job["params"],
+                "profile": job["profile"], "output": job["output"], "status": "pending", "attempts": 0,
+                "frames": 0, "wall_seconds": 0.0, "fps": 0.0, "errors": []} for job in jobs]
+    queue = []
+    for index, job in enumerate(jobs):
+        if not force and is_valid_output(job):
+            results[index]["status"] = "skipped"
+        else:
+            queue.append(index)
+    queue.sort(key=lambda index: audio_duration(jobs[index]["audio"]), reverse=True)
+    write_summary(summary_path, results, started)
+    if not queue:
+        return results
+
+    workers = workers or pool_size(len(queue), job_memory_mb)
+    # The cores are shared out between the jobs' encoders, rather than every job sizing its encoder to the machine
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    print("Rendering %d jobs in %d processes, %d already done" % (len(queue), workers, len(jobs) - len(queue)))
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(workers, mp_context=context)
+    pending = {}
+    try:
+        while queue or pending:
+            while queue and len(pending) < workers:
+                index = queue.pop(0)
+                results[index]["attempts"] += 1
+                pending[pool.submit(run_job, jobs[index], use_cache, threads)] = index
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # A worker died (out of memory, say) and took the pool down: every job in flight failed with it
+                # and counts an attempt, the rest run in a new pool
+                finished = list(pending)
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(workers, mp_context=context)
+            for future in finished:
+                index = pending.pop(future)
+                result = results[index]
+                try:
+                    frames, seconds = future.result()
+                except Exception as e:
+                    result["errors"].append("%s: %s" % (type(e).__name__, e))
+                    if result["attempts"] <= retries:
+                        queue.append(index)
+                    else:
+                        result["status"] = "failed"
+                    print("%s failed (attempt %d): %s" % (result["output"], result["attempts"], e), file=sys.stderr)
+                else:
+                    result.update(status="rendered", frames=frames, wall_seconds=seconds,
+                                  fps=frames / seconds if seconds else 0.0)
+                    print("%s: %d frames in %.1f s, %.1f fps" % (result["output"], frames, seconds, result["fps"]))
+            write_summary(summary_path, results, started)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render every scene x audio x seed job of a manifest in a pool of processes. Outputs that "
+                    "are already valid renders are skipped, so an interrupted batch picks up where it stopped.")
+    parser.add_argument("manifest", help="JSON (or YAML, with PyYAML) file with a list of jobs, see readme.md")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Jobs rendered at once (default: one per core, as many as fit in memory)")
+    parser.add_argument("--job-memory", type=int, default=JOB_MEMORY_MB, metavar="MB",
+                        help="Memory budgeted per job when sizing the pool (default %d)" % JOB_MEMORY_MB)
+    parser.add_argument("--retries", type=int, default=RETRIES, help="Extra attempts a failed job gets")
+    parser.add_argument("--force", action="store_true", help="Render every job, even if its output is valid")
+    parser.add_argument("--cache", action="store_true",
+                        help="Render through the render cache: jobs that only differ in audio are remuxed, longer "
+                             "tracks only render the missing tail")
+    parser.add_argument("--summary", metavar="PATH",
+                        help="Where the per-job summary goes (default: MANIFEST.summary.json)")
+    parser.add_argument("--dry-run", action="store_true", help="List the jobs and their outputs, render nothing")
+    args = parser.parse_args(argv)
+
+    try:
+        manifest = load_manifest(args.manifest)
+        jobs = expand_jobs(manifest, os.path.dirname(args.manifest))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.workers is not None and args.workers <= 0:
+        parser.error("--workers must be positive")
+    if args.dry_run:
+        for job in jobs:
+            print("%-18s %-30s seed %-10d -> %s" % (job["scene"], job["audio"], job["seed"], job["output"]))
+        return
+
+    summary_path = args.summary or os.path.splitext(args.manifest)[0] + ".summary.json"
+    results = run_batch(jobs, summary_path, args.workers, args.retries, args.force, args.job_memory, args.cache)
+    failed = [result for result in results if result["status"] == "failed"]
+    print("%d rendered, %d skipped, %d failed, summary in %s"
+          % (sum(result["status"] == "rendered" for result in results),
+             sum(result["status"] == "skipped" for result in results), len(failed), summary_path))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
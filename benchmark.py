@@ -0,0 +1,480 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+from capture import SurfaceCapture
+from encoder import PROFILES, FFmpegWriter
+import maze_solver
+from maze_grid import MazeGrid
+from particles import Particles
+from postfx import EFFECTS, PostFX, parse_effects
+from render import SCENES, encoder_options, load_scene, post_effects
+from sprites import CircleSprites
+
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 1920
+REPEATS = 20  # Timed frames per measurement
+PHASES = ["update", "draw", "capture", "encode"]
+MAX_WARMUP = 3600  # Frames a growing scene may simulate to reach the requested entity count
+
+# Scene parameter that sets how many entities it simulates. Falling balls grow with time instead.
+ENTITY_PARAMS = {
+    "multiplying_balls": "max_balls",
+    "repulsing_balls": "num_balls",
+    "galaxy": "num_stars",
+    "fireflies": "num_fireflies",
+    "molecules": "num_molecules",
+}
+
+
+def time_per_frame(draw, repeats=REPEATS):
+    draw()  # Warm up caches
+    start = time.perf_counter()
+    for _ in range(repeats):
+        draw()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def random_particles(count, radius, num_colors, sprites=None):
+    rng = np.random.default_rng(0)
+    palette = rng.integers(0, 256, (num_colors, 3))
+    colors = palette[rng.integers(0, num_colors, count)]
+    particles = Particles(capacity=count, sprite=object)
+    particles.add(rng.uniform(0, (SCREEN_WIDTH, SCREEN_HEIGHT), (count, 2)), np.zeros((count, 2)), colors, radius,
+                  sprite=sprites.sprite_array(radius, colors.tolist()) if sprites is not None else None)
+    return particles
+
+
+def bench_draw(args):
+    # Draw time per frame: pygame.draw.circle per entity, against one blits call with a cache lookup per
+    # entity, and with the sprite stored per particle at spawn as the scenes do
+    target = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), 0, 32)
+    print("%10s %8s %14s %14s %14s %14s" % ("entities", "radius", "draw.circle", "sprite lookup", "sprite field",
+                                            "antialiased"))
+    for count in args.counts:
+        particles = random_particles(count, args.radius, args.colors)
+
+        def draw_circles():
+            for position, color in zip(particles.pixel_positions().tolist(), particles.color.tolist()):
+                pygame.draw.circle(target, color, position, args.radius)
+
+        lookup = CircleSprites()
+        cached = CircleSprites()
+        with_sprites = random_particles(count, args.radius, args.colors, cached)
+        antialiased = CircleSprites(antialias=True)
+        aa_particles = random_particles(count, args.radius, args.colors, antialiased)
+        # Without the sprite field draw_particles falls back to looking sprites up by radius and color
+        plain = Particles(capacity=count)
+        plain.add(particles.position, particles.velocity, particles.color, particles.radius)
+        results = [time_per_frame(draw_circles),
+                   time_per_frame(lambda: lookup.draw_particles(target, plain)),
+                   time_per_frame(lambda: cached.draw_particles(target, with_sprites)),
+                   time_per_frame(lambda: antialiased.draw_particles(target, aa_particles))]
+        print("%10d %8d %11.2f ms %11.2f ms %11.2f ms %11.2f ms" % ((count, args.radius) + tuple(results)))
+
+
+class SinkWriter:
+    # Stands in for FFmpegWriter: copies each frame into a preallocated buffer like the write into
+    # ffmpeg's pipe would, so the timings don't depend on the encoder
+    def __init__(self, frame_size):
+        self.sink = np.empty(frame_size, np.uint8)
+
+    def write_frame(self, frame):
+        if isinstance(frame, np.ndarray) and not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame)
+        frame = np.frombuffer(frame, np.uint8)
+        self.sink[:len(frame)] = frame
+
+
+def allocated_per_frame(capture_frame):
+    # Peak Python heap allocated while capturing one frame
+    capture_frame()
+    tracemalloc.start()
+    capture_frame()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_capture(args):
+    # Capture cost per frame: the old array3d + transpose copy, the zero-copy buffer path, and a plain
+    # memcpy of one frame for reference
+    surface = pygame.Surface((args.width, args.height), 0, 32)
+    surface.fill((40, 80, 120))
+    writer = SinkWriter(args.width * args.height * 4)
+    capture = SurfaceCapture(surface)
+    source = np.frombuffer(surface.get_buffer().raw, np.uint8)
+    destination = np.empty_like(source)
+
+    paths = [
+        ("array3d + transpose", lambda: writer.write_frame(pygame.surfarray.array3d(surface).transpose([1, 0, 2]))),
+        ("buffer view (%s)" % capture.pix_fmt, lambda: capture.write(writer)),
+        ("memcpy reference", lambda: np.copyto(destination, source)),
+    ]
+    print("%24s %12s %16s" % ("capture path", "per frame", "allocated"))
+    for name, capture_frame in paths:
+        print("%24s %9.2f ms %13.1f KB" % (name, time_per_frame(capture_frame, args.repeats),
+                                          allocated_per_frame(capture_frame) / 1024))
+
+
+def effect_list(value):
+    try:
+        return ",".join(parse_effects(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def count_entities(scene):
+    return sum(len(value) for value in vars(scene).values() if isinstance(value, Particles))
+
+
+def summarize(samples):
+    # Milliseconds per frame
+    samples = np.asarray(samples) * 1000
+    return {"mean": float(samples.mean()), "p50": float(np.percentile(samples, 50)),
+            "p95": float(np.percentile(samples, 95)), "max": float(samples.max())}
+
+
+def run_scene(scene_name, count, scale, frames, warmup, seed, profile, encode, effects=""):
+    # Runs in a fresh process, so peak RSS belongs to this configuration alone. Capture copies each frame
+    # out of the surface like the pipe write does; encode is the write into ffmpeg's pipe, which blocks
+    # whenever the encoder falls behind, plus the final flush.
+    random.seed(seed)
+    params = {"scale": scale, "effects": effects}
+    if count is not None:
+        params[ENTITY_PARAMS[scene_name]] = count
+    scene = load_scene(scene_name)(**params)
+    scene.start(warmup + frames)
+    dt = 1 / scene.fps
+    # Scenes that grow (multiplying balls) keep simulating until they reach the count being measured
+    for frame in range(MAX_WARMUP):
+        if frame >= warmup and (count is None or count_entities(scene) >= count):
+            break
+        scene.update(dt)
+
+    surface = pygame.Surface(scene.output_size, 0, 32)
+    fx = post_effects(scene, surface)
+    capture = SurfaceCapture(fx.output if fx else surface)
+    width, height = scene.output_size
+    sink = SinkWriter(width * height * 4)
+    output = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False).name
+    writer = FFmpegWriter(output, scene.output_size, scene.fps, pix_fmt=capture.pix_fmt,
+                          **encoder_options(scene, profile)) if encode else None
+    timings = {phase: [] for phase in PHASES}
+    try:
+        for _ in range(frames):
+            start = time.perf_counter()
+            scene.update(dt)
+            updated = time.perf_counter()
+            scene.draw(surface)
+            if fx:
+                fx.apply(surface)
+            drawn = time.perf_counter()
+            capture.write(sink)
+            captured = time.perf_counter()
+            if writer is not None:
+                writer.write_frame(sink.sink)
+            timings["update"].append(updated - start)
+            timings["draw"].append(drawn - updated)
+            timings["capture"].append(captured - drawn)
+            timings["encode"].append(time.perf_counter() - captured)
+        if writer is not None:
+            start = time.perf_counter()
+            writer.close()
+            timings["encode"][-1] += time.perf_counter() - start
+    finally:
+        if writer is not None and writer.proc is not None:
+            writer.proc.kill()
+        os.remove(output)
+
+    encoder_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {"scene": scene_name, "count": count, "scale": scale, "size": list(scene.output_size),
+              "entities": count_entities(scene), "frames": frames,
+              "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+              "encoder_cpu_ms": (encoder_cpu.ru_utime + encoder_cpu.ru_stime) / frames * 1000 if encode else 0.0}
+    for phase, samples in timings.items():
+        result[phase] = summarize(samples)
+    result["total"] = summarize(np.sum([timings[phase] for phase in PHASES], axis=0))
+    return result
+
+
+def bench_scenes(args):
+    # Sweeps every scene over entity counts and drawing scales, each configuration in its own process
+    context = multiprocessing.get_context("spawn")
+    results = []
+    print("%18s %7s %6s %9s %9s %9s %9s %9s %9s"
+          % ("scene", "count", "scale", "entities", "update", "draw", "capture", "encode", "peak RSS"))
+    for scene_name in args.scenes:
+        counts = args.counts if scene_name in ENTITY_PARAMS else [None]
+        for count in counts:
+            for scale in args.scales:
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    result = pool.submit(run_scene, scene_name, count, scale, args.frames, args.warmup, args.seed,
+                                         args.profile, not args.no_encode, args.fx).result()
+                results.append(result)
+                print("%18s %7s %6g %9d %6.2f ms %6.2f ms %6.2f ms %6.2f ms %6.0f MB"
+                      % (scene_name, "-" if count is None else count, scale, result["entities"],
+                         result["update"]["mean"], result["draw"]["mean"], result["capture"]["mean"],
+                         result["encode"]["mean"], result["peak_rss_mb"]))
+
+    report = {
+        "machine": {"python": platform.python_version(), "numpy": np.__version__, "pygame": pygame.version.ver,
+                    "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {"frames": args.frames, "warmup": args.warmup, "seed": args.seed, "profile": args.profile,
+                     "encode": not args.no_encode, "effects": args.fx},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results written to %s" % args.output)
+
+
+def bench_compare(args):
+    # Flags configurations whose phase times (or peak RSS) grew by more than the threshold. Small absolute
+    # differences are ignored, they are timer noise.
+    with open(args.baseline) as f:
+        baseline = {(r["scene"], r["count"], r["scale"]): r for r in json.load(f)["results"]}
+    with open(args.candidate) as f:
+        candidate = json.load(f)["results"]
+
+    regressions = 0
+    print("%18s %7s %6s %9s %10s %10s %8s" % ("scene", "count", "scale", "metric", "baseline", "candidate", "change"))
+    for result in candidate:
+        key = (result["scene"], result["count"], result["scale"])
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        metrics = [(phase, before[phase][args.statistic], result[phase][args.statistic], args.min_ms)
+                   for phase in PHASES + ["total"]]
+        metrics.append(("RSS MB", before["peak_rss_mb"], result["peak_rss_mb"], args.min_mb))
+        for name, old, new, minimum in metrics:
+            change = (new - old) / old if old else 0.0
+            regressed = change > args.threshold and new - old > minimum
+            regressions += regressed
+            if regressed or args.verbose:
+                print("%18s %7s %6g %9s %10.2f %10.2f %+7.0f%%%s"
+                      % (key[0], "-" if key[1] is None else key[1], key[2], name, old, new, change * 100,
+                         "  REGRESSION" if regressed else ""))
+    print("%d regression%s" % (regressions, "" if regressions == 1 else "s"))
+    return 1 if regressions else 0
+
+
+class LegacyMaze:
+    # big_ball's original generator, kept to benchmark against: a sprite with its own Surface per cell, and a
+    # list of unvisited cells searched with `in` and list.remove, which makes generation quadratic
+    class Cell:
+        def __init__(self, x, y, w, h, color):
+            self.image = pygame.Surface([1, 1])
+            self.image.fill(color)
+            self.x, self.y = x, y
+            self.nbs = [(x + nx, y + ny) for nx, ny in ((-2, 0), (0, -2), (2, 0), (0, 2))
+                        if 0 <= x + nx < w and 0 <= y + ny < h]
+
+    def __init__(self, w, h):
+        self.w, self.h = w, h
+        self.grid = [[self.Cell(x, y, w, h, (0, 0, 0)) for y in range(h)] for x in range(w)]
+
+    def generate(self):
+        unvisited = [c for r in self.grid for c in r if c.x % 2 and c.y % 2]
+        cur = unvisited.pop()
+        stack = []
+        while unvisited:
+            try:
+                n = random.choice([c for c in map(lambda x: self.grid[x[0]][x[1]], cur.nbs) if c in unvisited])
+                stack.append(cur)
+                nx, ny = cur.x - (cur.x - n.x) // 2, cur.y - (cur.y - n.y) // 2
+                self.grid[nx][ny] = self.Cell(nx, ny, self.w, self.h, (255, 255, 255))
+                self.grid[cur.x][cur.y] = self.Cell(cur.x, cur.y, self.w, self.h, (255, 255, 255))
+                cur = n
+                unvisited.remove(n)
+            except IndexError:
+                if stack:
+                    cur = stack.pop()
+
+
+def bench_maze(args):
+    # Maze generation time, the list-based sprite maze against the byte grid. The legacy generator is
+    # quadratic, so it only runs up to --legacy-max cells.
+    print("%12s %10s %12s %12s %9s" % ("grid", "cells", "legacy", "byte grid", "speedup"))
+    for size in args.sizes:
+        width, height = (int(side) for side in size.split("x"))
+        random.seed(0)
+        grid = MazeGrid(width, height)
+        start = time.perf_counter()
+        grid.generate()
+        fast = time.perf_counter() - start
+        legacy = None
+        if width * height <= args.legacy_max:
+            random.seed(0)
+            maze = LegacyMaze(width, height)
+            start = time.perf_counter()
+            maze.generate()
+            legacy = time.perf_counter() - start
+        print("%12s %10d %12s %10.3f s %9s"
+              % (size, width * height, "-" if legacy is None else "%10.3f s" % legacy, fast,
+                 "-" if legacy is None else "%.0fx" % (legacy / fast)))
+
+
+def legacy_solve(grid, start, end):
+    # big_ball's original BFS: a deque of tuples and a set and dict keyed by them, with walls told apart per
+    # neighbour (the original's isinstance check couldn't, this asks the grid)
+    queue = deque([start])
+    visited = {start}
+    parent = {start: None}
+    while queue:
+        x, y = queue.popleft()
+        if (x, y) == end:
+            path = []
+            while (x, y) != start:
+                path.append((x, y))
+                x, y = parent[(x, y)]
+            return [start] + path[::-1]
+        for nx, ny in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
+            if 0 <= nx < grid.width and 0 <= ny < grid.height and (nx, ny) not in visited \
+                    and grid.is_passage(nx, ny):
+                queue.append((nx, ny))
+                visited.add((nx, ny))
+                parent[(nx, ny)] = (x, y)
+    return []
+
+
+def bench_solve(args):
+    # Corner to corner solve time of each solver on the flat grid, against the tuple-keyed BFS, and a cached
+    # solve. Every path is checked to only cross passages.
+    methods = sorted(maze_solver.SOLVERS)
+    print("%12s %10s %9s %12s" % ("grid", "cells", "path", "legacy") + "".join("%14s" % name for name in methods)
+          + "%12s" % "cached")
+    for size in args.sizes:
+        width, height = (int(side) for side in size.split("x"))
+        grid = MazeGrid(width, height)
+        grid.generate(seed=args.seed)
+        start, end = grid.odd_corners()
+        legacy = None
+        if width * height <= args.legacy_max:
+            began = time.perf_counter()
+            legacy_solve(grid, start, end)
+            legacy = time.perf_counter() - began
+        timings = []
+        for method in methods:
+            began = time.perf_counter()
+            path = maze_solver.SOLVERS[method](grid, start, end)
+            timings.append(time.perf_counter() - began)
+            if not maze_solver.is_valid_path(grid, path, start, end):
+                raise AssertionError("%s found an invalid path through %s" % (method, size))
+        grid.solve(start, end)
+        began = time.perf_counter()
+        grid.solve(start, end)
+        cached = time.perf_counter() - began
+        print("%12s %10d %9d %12s" % (size, width * height, len(path),
+                                      "-" if legacy is None else "%10.3f s" % legacy)
+              + "".join("%12.3f s" % seconds for seconds in timings) + "%9.3f ms" % (cached * 1000))
+
+
+def bench_fx(args):
+    # Post-processing time per frame of each effect alone and of all of them together, over entity counts.
+    # Every pass works on the whole frame, so only the frame size should move the numbers.
+    combinations = [[name] for name in EFFECTS] + [EFFECTS]
+    print("%6s %11s %10s" % ("scale", "frame", "entities")
+          + "".join("%12s" % (names[0] if len(names) == 1 else "all") for names in combinations))
+    for scale in args.scales:
+        size = (max(int(round(SCREEN_WIDTH * scale)), 1), max(int(round(SCREEN_HEIGHT * scale)), 1))
+        target = pygame.Surface(size, 0, 32)
+        sprites = CircleSprites(scale=scale)
+        for count in args.counts:
+            particles = random_particles(count, args.radius, 256, sprites)
+            target.fill((0, 0, 0))
+            sprites.draw_particles(target, particles)
+            # The passes cost the same whatever the pixels are, so the frame isn't redrawn between repeats
+            results = []
+            for names in combinations:
+                fx = PostFX(target, names, scale)
+                results.append(time_per_frame(lambda: fx.apply(target), args.repeats))
+            print("%6g %11s %10d" % (scale, "%dx%d" % size, count) + "".join("%9.2f ms" % ms for ms in results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rendering benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    draw = subparsers.add_parser("draw", help="Circle draw time per frame against entity count")
+    draw.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 2500, 10000, 50000])
+    draw.add_argument("--radius", type=int, default=10)
+    draw.add_argument("--colors", type=int, default=256, help="Number of distinct colors")
+    draw.set_defaults(run=bench_draw)
+
+    capture = subparsers.add_parser("capture", help="Frame capture cost against a single memcpy")
+    capture.add_argument("--width", type=int, default=SCREEN_WIDTH)
+    capture.add_argument("--height", type=int, default=SCREEN_HEIGHT)
+    capture.add_argument("--repeats", type=int, default=50)
+    capture.set_defaults(run=bench_capture)
+
+    scenes = subparsers.add_parser("scenes", help="Per-phase frame cost of each scene against entity count")
+    scenes.add_argument("--scenes", nargs="+", choices=sorted(SCENES), default=sorted(SCENES))
+    scenes.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="Entity counts, for the scenes that have one")
+    scenes.add_argument("--scales", type=float, nargs="+", default=[1.0], help="Drawing scales")
+    scenes.add_argument("--frames", type=int, default=120, help="Timed frames per configuration")
+    scenes.add_argument("--warmup", type=int, default=60,
+                        help="Frames simulated before timing. Growing scenes simulate until they reach the entity "
+                             "count, up to %d frames" % MAX_WARMUP)
+    scenes.add_argument("--seed", type=int, default=0)
+    scenes.add_argument("--profile", choices=PROFILES, help="Encode profile, defaults to each scene's own settings")
+    scenes.add_argument("--no-encode", action="store_true", help="Skip the encoder")
+    scenes.add_argument("--fx", type=effect_list, default="",
+                        help="Post-processing effects, timed as part of draw: %s" % ", ".join(EFFECTS))
+    scenes.add_argument("-o", "--output", help="Write the results as JSON")
+    scenes.set_defaults(run=bench_scenes)
+
+    maze = subparsers.add_parser("maze", help="Maze generation time, sprite maze against the byte grid")
+    maze.add_argument("--sizes", nargs="+", default=["50x50", "100x100", "200x200", "1920x1080", "3840x2160"],
+                      help="Grid sizes in cells, WIDTHxHEIGHT")
+    maze.add_argument("--legacy-max", type=int, default=40000, help="Largest grid the legacy generator runs on")
+    maze.set_defaults(run=bench_maze)
+
+    solve = subparsers.add_parser("solve", help="Maze solve time of each solver, against the tuple-keyed BFS")
+    solve.add_argument("--sizes", nargs="+", default=["201x201", "1001x1001", "1921x1081", "2001x2001"],
+                       help="Grid sizes in cells, WIDTHxHEIGHT")
+    solve.add_argument("--legacy-max", type=int, default=1100000, help="Largest grid the legacy BFS runs on")
+    solve.add_argument("--seed", type=int, default=0, help="Seed the mazes are carved from")
+    solve.set_defaults(run=bench_solve)
+
+    fx = subparsers.add_parser("fx", help="Post-processing time of each effect against entity count")
+    fx.add_argument("--counts", type=int, nargs="+", default=[100, 10000])
+    fx.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.25], help="Drawing scales")
+    fx.add_argument("--radius", type=int, default=10)
+    fx.add_argument("--repeats", type=int, default=REPEATS)
+    fx.set_defaults(run=bench_fx)
+
+    compare = subparsers.add_parser("compare", help="Flag regressions between two scenes result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown flagged (default 10%%)")
+    compare.add_argument("--statistic", choices=["mean", "p50", "p95", "max"], default="p50")
+    compare.add_argument("--min-ms", type=float, default=0.05, help="Ignore smaller absolute slowdowns")
+    compare.add_argument("--min-mb", type=float, default=5, help="Ignore smaller peak RSS increases")
+    compare.add_argument("-v", "--verbose", action="store_true", help="Print every metric, not only regressions")
+    compare.set_defaults(run=bench_compare)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,136 +1,168 @@
+import math
+import random
+
+import numpy as np
 import pygame
-from random import choice
-from collections import deque
+
+from maze_grid import PASSAGE, MazeGrid
+from maze_solver import DEFAULT_SOLVER
+from scene import Scene
+from sprites import CircleSprites
 
 # Constants
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = 800
+VIDEO_SIZE = (1080, 1920)  # The rendered scene, Reels / Shorts like the others
 CELL_SIZE = 16  # Size of each cell in the maze
-BALL_RADIUS = 8  # Radius of the ball
+DURATION = 60  # Seconds the animation is paced for until the runtime says how long the render is
+CARVE_SHARE = 0.6  # Part of the render spent carving, when the steps per frame are left to the scene
+ARRIVAL = 0.95  # Point in the render the ball reaches the end of the path
 
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 RED = (255, 0, 0)
+TRAIL = (255, 190, 190)  # Passages the ball went through
+
+TRAIL_CELL = 2  # Cell type of passages the ball went through, after maze_grid's WALL and PASSAGE
+CELL_COLORS = np.array([BLACK, WHITE, TRAIL], np.uint8)  # Indexed by cell type
+
+
+def cell_edges(count, cell_size, scale=1.0):
+    # Pixel edges of count cells in a row, rounded once so scaled cells tile exactly
+    return np.rint(np.arange(count + 1) * cell_size * scale).astype(np.int64)
+
+
+def cell_images(cell_size, scale=1.0):
+    # One image per cell type, shared by every cell of that type. Scaled cells are a pixel smaller here and
+    # there, they blit the part of the image they cover.
+    side = max(int(math.ceil(cell_size * scale)), 1)
+    images = []
+    for color in CELL_COLORS.tolist():
+        image = pygame.Surface((side, side))
+        image.fill(color)
+        images.append(image)
+    return images
+
+
+def composite(types, x_edges, y_edges, target):
+    # Draws a whole (height, width) array of cell types onto target at once: every pixel looks up the cell it
+    # falls in and that cell's color, no per-cell surfaces or blits. Pixels past the last cell are wall.
+    width, height = target.get_size()
+    padded = np.zeros((types.shape[0] + 1, types.shape[1] + 1), np.uint8)
+    padded[:-1, :-1] = types
+    columns = np.minimum(np.searchsorted(x_edges, np.arange(width), side="right") - 1, types.shape[1])
+    rows = np.minimum(np.searchsorted(y_edges, np.arange(height), side="right") - 1, types.shape[0])
+    # surfarray indexes pixels (x, y)
+    pygame.surfarray.blit_array(target, CELL_COLORS[padded.T[np.ix_(columns, rows)]])
+
+
+class MazeScene(Scene):
+    # The maze carved cell by cell, then a ball following the path. The state at a frame is closed form, and a
+    # frame only copies the cells that changed onto the target.
+    title = "Maze Generator and Solver"
+    size = VIDEO_SIZE
+    fps = 60
+    bg_color = BLACK
+    output = "maze_with_audio.mp4"
+    random_access = True
+    cell_size = CELL_SIZE
+    carve_steps = 0  # Cells opened per frame, 0 to carve in CARVE_SHARE of the render
+    ball_steps = 0.0  # Path cells the ball moves per frame, 0 to arrive at ARRIVAL of the render
+    solver = DEFAULT_SOLVER  # bfs or bidirectional, both find a shortest path
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.sprites = CircleSprites(antialias=self.antialias, scale=self.scale)
+        self.maze = MazeGrid(self.size[0] // self.cell_size, self.size[1] // self.cell_size)
+        # Carved from a seed of its own, drawn from the render's, so its path is cached across renders
+        self.order = self.maze.generate(seed=random.randrange(2 ** 32))
+        self.path = self.maze.solve(*self.maze.odd_corners(), method=self.solver)
+
+        self.x_edges = cell_edges(self.maze.width, self.cell_size, self.scale)
+        self.y_edges = cell_edges(self.maze.height, self.cell_size, self.scale)
+        self.ball_radius = max(self.cell_size // 2, 1)
+        self._reset_background()
+        self.start(DURATION * self.fps)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # Surfaces, made again and repainted from the progress on the next draw
+        state["_background"] = state["_target"] = state["_images"] = None
+        return state
+
+    def _reset_background(self):
+        self._background = None
+        self._images = None
+        self._target = None
+        self._carved_drawn = self._trail_drawn = 0
+        self._ball_rect = None
+
+    def start(self, total_frames):
+        # Steps per frame left at 0 are paced to the length of the render
+        self.carve_rate = self.carve_steps or max(math.ceil(len(self.order) / (CARVE_SHARE * total_frames)), 1)
+        self.carve_frames = math.ceil(len(self.order) / self.carve_rate)
+        # At least a second of travel when carving takes up the whole render
+        self.ball_rate = self.ball_steps or len(self.path) / max(ARRIVAL * total_frames - self.carve_frames, self.fps)
+        self.seek(0)
+
+    def seek(self, frame):
+        self.frame = frame
+        self.carved = min(frame * self.carve_rate, len(self.order))
+        if frame < self.carve_frames or not len(self.path):
+            self.ball = -1  # The ball appears once the maze is complete
+        else:
+            self.ball = min(int((frame - self.carve_frames) * self.ball_rate), len(self.path) - 1)
+
+    def update(self, dt):
+        self.seek(self.frame + 1)
+
+    def cell_rect(self, index):
+        y, x = divmod(index, self.maze.width)
+        left, top = self.x_edges[x], self.y_edges[y]
+        return pygame.Rect(left, top, self.x_edges[x + 1] - left, self.y_edges[y + 1] - top)
+
+    def draw(self, target):
+        trail = self.ball + 1
+        if self._background is None or self.carved < self._carved_drawn or trail < self._trail_drawn:
+            # First frame, after a snapshot was restored, or a seek backwards: the progress so far is composited
+            # in one go, however far into the render it is
+            self._reset_background()
+            self._background = pygame.Surface(target.get_size(), 0, target)
+            self._images = cell_images(self.cell_size, self.scale)
+            types = np.zeros(len(self.maze), np.uint8)
+            types[self.order[:self.carved]] = PASSAGE
+            types[self.path[:trail]] = TRAIL_CELL
+            composite(types.reshape(self.maze.grid.shape), self.x_edges, self.y_edges, self._background)
+            self._carved_drawn, self._trail_drawn = self.carved, trail
+
+        # Cells that changed since the last frame, each a blit of the image its type shares
+        background = self._background
+        passage, trail_image = self._images[PASSAGE], self._images[TRAIL_CELL]
+        dirty = [self.cell_rect(index) for index in self.order[self._carved_drawn:self.carved].tolist()]
+        opened = len(dirty)
+        dirty += [self.cell_rect(index) for index in self.path[self._trail_drawn:trail].tolist()]
+        background.blits([(passage if i < opened else trail_image, rect, (0, 0, rect.w, rect.h))
+                          for i, rect in enumerate(dirty)], doreturn=False)
+        self._carved_drawn, self._trail_drawn = self.carved, trail
+
+        if target is not self._target:
+            target.blit(background, (0, 0))
+            self._target = target
+        else:
+            if self._ball_rect is not None:
+                dirty.append(self._ball_rect)
+            target.blits([(background, rect, rect) for rect in dirty], doreturn=False)
+
+        self._ball_rect = None
+        if self.ball >= 0:
+            rect = self.cell_rect(self.path[self.ball])
+            radius = self.sprites.scaled(self.ball_radius)
+            self._ball_rect = target.blit(self.sprites.get(self.ball_radius, RED),
+                                          (rect.centerx - radius, rect.centery - radius))
 
-class Cell(pygame.sprite.Sprite):
-    w, h = CELL_SIZE, CELL_SIZE
-
-    def __init__(self, x, y, maze):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.Surface([self.w, self.h])
-        self.image.fill(WHITE)
-        self.rect = self.image.get_rect()
-        self.rect.x = x * self.w
-        self.rect.y = y * self.h
-        self.x = x
-        self.y = y
-        self.maze = maze
-        self.nbs = [(x + nx, y + ny) for nx, ny in ((-2, 0), (0, -2), (2, 0), (0, 2))
-                    if 0 <= x + nx < maze.w and 0 <= y + ny < maze.h]
-
-    def draw(self, screen):
-        screen.blit(self.image, self.rect)
-
-class Wall(Cell):
-    def __init__(self, x, y, maze):
-        super(Wall, self).__init__(x, y, maze)
-        self.image.fill(BLACK)
-        self.type = 0
-
-class Maze:
-    def __init__(self, size):
-        self.w, self.h = size[0] // Cell.w, size[1] // Cell.h
-        self.grid = [[Wall(x, y, self) for y in range(self.h)] for x in range(self.w)]
-
-    def get(self, x, y):
-        return self.grid[x][y]
-
-    def place_wall(self, x, y):
-        self.grid[x][y] = Wall(x, y, self)
-
-    def draw(self, screen):
-        for row in self.grid:
-            for cell in row:
-                cell.draw(screen)
-
-    def generate(self, screen=None, animate=False):
-        unvisited = [c for r in self.grid for c in r if c.x % 2 and c.y % 2]
-        cur = unvisited.pop()
-        stack = []
-
-        while unvisited:
-            try:
-                n = choice([c for c in map(lambda x: self.get(*x), cur.nbs) if c in unvisited])
-                stack.append(cur)
-                nx, ny = cur.x - (cur.x - n.x) // 2, cur.y - (cur.y - n.y) // 2
-                self.grid[nx][ny] = Cell(nx, ny, self)
-                self.grid[cur.x][cur.y] = Cell(cur.x, cur.y, self)
-                cur = n
-                unvisited.remove(n)
-
-                if animate:
-                    self.draw(screen)
-                    pygame.display.update()
-                    pygame.time.wait(10)
-            except IndexError:
-                if stack:
-                    cur = stack.pop()
-
-    def solve(self, start, end):
-        queue = deque([start])
-        visited = {start}
-        parent = {start: None}
-
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) == end:
-                path = []
-                while (x, y) is not None:
-                    path.append((x, y))
-                    x, y = parent[(x, y)]
-                return path[::-1]
-
-            for nx, ny in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
-                if 0 <= nx < self.w and 0 <= ny < self.h and (nx, ny) not in visited and isinstance(self.grid[nx][ny], Cell):
-                    queue.append((nx, ny))
-                    visited.add((nx, ny))
-                    parent[(nx, ny)] = (x, y)
-
-        return []
-
-def main():
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.HIDDEN)
-    pygame.display.set_caption("Maze Generator and Solver")
-
-    maze = Maze((SCREEN_WIDTH, SCREEN_HEIGHT))
-    maze.generate(screen=screen, animate=True)
-
-    start = (0, 0)
-    end = (maze.w - 1, maze.h - 1)
-    path = maze.solve(start, end)
-
-    running = True
-    ball_pos = 0
-
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        screen.fill(WHITE)
-        maze.draw(screen)
-
-        if ball_pos < len(path):
-            x, y = path[ball_pos]
-            pygame.draw.circle(screen, RED, (x * CELL_SIZE + CELL_SIZE // 2, y * CELL_SIZE + CELL_SIZE // 2), BALL_RADIUS)
-            ball_pos += 1
-
-        pygame.display.flip()
-        pygame.time.wait(100)  # Adjust the speed of the ball
-
-    pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    import sys
+
+    import render
+
+    render.main(["maze"] + sys.argv[1:])
@@ -0,0 +1,55 @@
+import sys
+
+import numpy as np
+
+# Packed 32-bit layouts ffmpeg reads directly as rawvideo input
+FFMPEG_PIXEL_FORMATS = {"rgb0", "bgr0", "0rgb", "0bgr"}
+
+
+def pixel_format(surface):
+    # ffmpeg pix_fmt matching the byte order of the surface's pixels in memory, e.g. "bgr0"
+    if surface.get_bytesize() != 4:
+        raise ValueError("Only 32-bit surfaces can be captured without conversion, got %d bits"
+                         % surface.get_bitsize())
+    channels = ["0"] * 4
+    for name, shift in zip("rgb", surface.get_shifts()[:3]):
+        byte = shift // 8
+        channels[byte if sys.byteorder == "little" else 3 - byte] = name
+    pix_fmt = "".join(channels)
+    if pix_fmt not in FFMPEG_PIXEL_FORMATS:
+        raise ValueError("Unsupported surface pixel layout %s" % pix_fmt)
+    return pix_fmt
+
+
+class SurfaceCapture:
+    # Hands a surface's pixels to the encoder straight from its pixel buffer, in the surface's own pix_fmt
+    def __init__(self, surface):
+        self.surface = surface
+        self.pix_fmt = pixel_format(surface)
+        width, height = surface.get_size()
+        self.contiguous = surface.get_pitch() == width * 4
+        self._packed = None if self.contiguous else np.empty((height, width * 4), np.uint8)
+
+    def write(self, writer):
+        # The buffer keeps the surface locked, so it must not outlive this call
+        buffer = self.surface.get_buffer()
+        try:
+            if self.contiguous:
+                writer.write_frame(memoryview(buffer))
+            else:
+                rows = np.frombuffer(buffer, np.uint8).reshape(self._packed.shape[0], -1)
+                self._packed[:] = rows[:, :self._packed.shape[1]]
+                writer.write_frame(self._packed)
+        finally:
+            del buffer
+
+    def copy_to(self, out):
+        # Packs the pixels into out, a flat uint8 array of width * height * 4 bytes, e.g. a slot of shared
+        # memory another process encodes from
+        buffer = self.surface.get_buffer()
+        try:
+            width, height = self.surface.get_size()
+            rows = np.frombuffer(buffer, np.uint8).reshape(height, -1)
+            out.reshape(height, width * 4)[:] = rows[:, :width * 4]
+        finally:
+            del buffer
@@ -0,0 +1,172 @@
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+AUDIO_FPS = 44100  # Sample rate moviepy resampled the soundtrack to
+
+# Named trade-offs between encode speed and quality, applied on top of a scene's codec choice
+PROFILES = {
+    "draft": {"preset": "ultrafast", "ffmpeg_params": ["-crf", "28"], "bitrate": None},  # Quick review renders
+    "balanced": {"preset": "veryfast", "ffmpeg_params": ["-crf", "21", "-tune", "animation"], "bitrate": None},
+    "final": {"preset": "slow", "ffmpeg_params": ["-crf", "18"], "bitrate": "5000k"},  # The upload settings
+}
+
+
+def get_ffmpeg_exe():
+    # Same lookup moviepy uses: IMAGEIO_FFMPEG_EXE, then the bundled binary. Imported here so it's
+    # only loaded when an encoder is actually started.
+    import imageio_ffmpeg
+
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def encoder_threads(cores=None):
+    # The render loop keeps one core busy producing frames, the encoder gets the rest
+    cores = cores or os.cpu_count() or 1
+    return max(cores - 1, 1)
+
+
+def profile_options(name, cores=None):
+    # FFmpegWriter options for a named profile, with the thread count sized to the machine
+    if name not in PROFILES:
+        raise ValueError("Unknown encode profile %r, choose from: %s" % (name, ", ".join(PROFILES)))
+    return dict(PROFILES[name], threads=encoder_threads(cores))
+
+
+def concat_segments(segments, output, audio_path=None, audio_codec="aac"):
+    # Joins video segments encoded with identical settings without re-encoding them (ffmpeg's concat
+    # demuxer), muxing the soundtrack in like FFmpegWriter does
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+        for segment in segments:
+            listing.write("file '%s'\n" % os.path.abspath(segment).replace("'", "'\\''"))
+    cmd = [get_ffmpeg_exe(), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing.name]
+    if audio_path is not None:
+        cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-acodec", audio_codec, "-ar", str(AUDIO_FPS),
+                "-shortest"]
+    cmd += ["-vcodec", "copy", output]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(listing.name)
+    if result.returncode != 0:
+        raise IOError("ffmpeg failed to join the segments of %s:\n%s"
+                      % (output, result.stderr.decode(errors="replace")))
+
+
+class FFmpegWriter:
+    # Streams raw frames into one ffmpeg process as they are produced, with the command line moviepy ran
+    def __init__(self, filename, size, fps, audio_path=None, audio_start=0.0, pix_fmt="rgb24", codec="libx264",
+                 audio_codec="aac", preset="medium", bitrate=None, ffmpeg_params=None, threads=None):
+        width, height = size
+        self.filename = filename
+        self.size = size
+        self.fps = fps
+        self.frames_written = 0
+        self.write_time = 0.0  # Seconds spent blocked handing frames to ffmpeg, high when encoding is the bottleneck
+        self.elapsed = None
+
+        cmd = [
+            get_ffmpeg_exe(),
+            "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-vcodec", "rawvideo",
+            "-s", "%dx%d" % (width, height),
+            "-pix_fmt", pix_fmt,  # Layout of the frames we write, see capture.pixel_format
+            "-r", "%.02f" % fps,
+            "-i", "-",
+        ]
+        if audio_path is not None:
+            # Trim the soundtrack to the video, like clip.set_audio() did
+            if audio_start:
+                cmd += ["-ss", "%.6f" % audio_start]
+            cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0",
+                    "-acodec", audio_codec, "-ar", str(AUDIO_FPS), "-shortest"]
+        else:
+            cmd += ["-an"]
+        cmd += ["-vcodec", codec, "-preset", preset]
+        if ffmpeg_params is not None:
+            cmd += ffmpeg_params
+        if bitrate is not None:
+            cmd += ["-b", bitrate]
+        if threads is not None:
+            cmd += ["-threads", str(threads)]
+        if codec == "libx264" and width % 2 == 0 and height % 2 == 0:
+            cmd += ["-pix_fmt", "yuv420p"]
+        cmd.append(filename)
+
+        # ffmpeg's log goes to a temp file so a chatty encoder can never fill a pipe and stall us
+        self.log = tempfile.TemporaryFile()
+        self.started = time.perf_counter()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+
+    def write_frame(self, frame):
+        # frame is any buffer holding one packed frame in the writer's pix_fmt: bytes, a memoryview of a
+        # surface's pixels or a (height, width, channels) uint8 array. Contiguous buffers are written as is.
+        if isinstance(frame, np.ndarray) and not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame)
+        start = time.perf_counter()
+        try:
+            self.proc.stdin.write(frame)
+        except (BrokenPipeError, OSError):
+            self.proc.wait()
+            raise IOError("ffmpeg stopped accepting frames for %s:\n%s" % (self.filename, self._read_log()))
+        self.write_time += time.perf_counter() - start
+        self.frames_written += 1
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self.proc.wait()
+        self.elapsed = time.perf_counter() - self.started
+        self.proc = None
+        log = self._read_log()
+        self.log.close()
+        if returncode != 0:
+            raise IOError("ffmpeg failed to encode %s:\n%s" % (self.filename, log))
+
+    def stats(self):
+        # Throughput and output bitrate of a finished encode
+        duration = self.frames_written / self.fps
+        size = os.path.getsize(self.filename)
+        return {
+            "frames": self.frames_written,
+            "seconds": self.elapsed,
+            "fps": self.frames_written / self.elapsed if self.elapsed else 0.0,
+            "write_seconds": self.write_time,
+            "bytes": size,
+            "bitrate_kbps": size * 8 / duration / 1000 if duration else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return ("%s: %d frames in %.1f s, %.1f fps encoded (%.1f s waiting on the encoder), %.0f kb/s, %.1f MB"
+                % (self.filename, stats["frames"], stats["seconds"], stats["fps"], stats["write_seconds"],
+                   stats["bitrate_kbps"], stats["bytes"] / 1e6))
+
+    def _read_log(self):
+        self.log.seek(0)
+        return self.log.read().decode(errors="replace")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.proc is not None:
+            # Don't leave a half-written file looking like a finished render
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+            self.log.close()
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            return False
+        self.close()
+        return False
@@ -1,9 +1,11 @@
 import pygame
 import random
-import time
-import subprocess
-from moviepy.editor import ImageSequenceClip, AudioFileClip
-import sys
+
+import numpy as np
+
+from particles import Particles
+from scene import Scene
+from sprites import CircleSprites
 
 # Constants
 SCREEN_WIDTH = 1080
@@ -14,114 +16,86 @@ FRICTION = 0.99
 ELASTICITY = 0.8
 BG_COLOR = (0, 0, 0)
 BALL_SPAWN_RATE = 10  # Number of frames between spawning new balls
+SLEEP_SPEED = 0.005  # A ball resting on the floor slower than this has less than half a pixel left to slide
+SLEEP_BOUNCE = 0.5  # Largest vertical speed of a ball resting on the floor, it hops a fraction of a pixel
 FPS = 60  # Frames per second for the video
 
 # Random color generator
 def random_color():
     return (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
 
-class Ball:
-    def __init__(self, x, y, vx, vy, color):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.color = color
+class FallingBalls(Scene):
+    title = "Bouncing Balls"
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    fps = FPS
+    bg_color = BG_COLOR
+    output = "bouncing_balls_with_audio.mp4"
+    spawn_rate = BALL_SPAWN_RATE
+    sleep = True  # Retire balls at rest into the background, off to simulate and draw every ball every frame
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.sprites = CircleSprites(antialias=self.antialias, scale=self.scale)
+        self.balls = Particles(sprite=object)
+        # Balls that came to rest. Nothing moves them again, so they are drawn once into the floor layer and
+        # no longer updated, and the active balls stay a pool of the few that are still moving.
+        self.sleeping = Particles(sprite=object)
+        self.frame_count = 0
+        self._layer = None
+        self._baked = 0  # Sleeping balls drawn into the layer so far
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_layer"], state["_baked"] = None, 0  # Drawn again from the sleeping balls
+        return state
+
+    def update(self, dt):
+        balls = self.balls
+
+        # Add new ball at regular intervals
+        if self.frame_count % self.spawn_rate == 0:
+            position = (random.randint(BALL_RADIUS, SCREEN_WIDTH - BALL_RADIUS),
+                        random.randint(-SCREEN_HEIGHT, -BALL_RADIUS))
+            velocity = (random.uniform(-5, 5), random.uniform(-5, 5))
+            color = random_color()
+            balls.add(position, velocity, color, BALL_RADIUS, sprite=self.sprites.get(BALL_RADIUS, color))
 
-    def update(self):
-        self.vy += GRAVITY  # Apply gravity
-        self.x += self.vx
-        self.y += self.vy
+        balls.velocity[:, 1] += GRAVITY  # Apply gravity
+        balls.integrate()
 
         # Bounce off the floor
-        if self.y + BALL_RADIUS > SCREEN_HEIGHT:
-            self.y = SCREEN_HEIGHT - BALL_RADIUS
-            self.vy = -self.vy * ELASTICITY
-            self.vx *= FRICTION
+        floor = balls.bounce(1, None, SCREEN_HEIGHT, elasticity=ELASTICITY, inclusive=False)
+        balls.velocity[floor, 0] *= FRICTION
 
         # Bounce off the walls
-        if self.x + BALL_RADIUS > SCREEN_WIDTH:
-            self.x = SCREEN_WIDTH - BALL_RADIUS
-            self.vx = -self.vx * ELASTICITY
-        elif self.x - BALL_RADIUS < 0:
-            self.x = BALL_RADIUS
-            self.vx = -self.vx * ELASTICITY
-
-    def draw(self, screen):
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), BALL_RADIUS)
-
-def get_audio_duration(audio_path):
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1",
-         audio_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    return float(result.stdout)
-
-def main(audio_path):
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.HIDDEN)
-    pygame.display.set_caption("Bouncing Balls")
-    clock = pygame.time.Clock()
-
-    balls = []
-    frame_count = 0
-
-    # Get the audio duration
-    audio_duration = get_audio_duration(audio_path)
-    frames = []
-    running = True
-    start_time = time.time()
-
-    while running and (time.time() - start_time) < audio_duration:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        screen.fill(BG_COLOR)
-
-        # Add new ball at regular intervals
-        if frame_count % BALL_SPAWN_RATE == 0:
-            new_ball = Ball(
-                random.randint(BALL_RADIUS, SCREEN_WIDTH - BALL_RADIUS),
-                random.randint(-SCREEN_HEIGHT, -BALL_RADIUS),
-                random.uniform(-5, 5),
-                random.uniform(-5, 5),
-                random_color()
-            )
-            balls.append(new_ball)
-
-        for ball in balls:
-            ball.update()
-            ball.draw(screen)
-
-        # Capture the current frame
-        frame = pygame.surfarray.array3d(screen)
-        frame = frame.transpose([1, 0, 2])  # Convert from (width, height, colors) to (height, width, colors)
-        frames.append(frame)
-
-        pygame.display.flip()
-        clock.tick(FPS)
-        frame_count += 1
-
-    pygame.quit()
-
-    # Save the captured frames as a video file
-    clip = ImageSequenceClip(frames, fps=FPS)
-
-    # Load the audio file
-    try:
-        audio_clip = AudioFileClip(audio_path)
-        final_clip = clip.set_audio(audio_clip)
-        final_clip.write_videofile("bouncing_balls_with_audio.mp4", codec="libx264", audio_codec="aac")
-    except Exception as e:
-        print(f"Error loading audio file: {e}")
+        walls = balls.bounce(0, 0, SCREEN_WIDTH, elasticity=ELASTICITY, inclusive=False)
+        self.frame_count += 1
+
+        if not self.sleep:
+            return
+        # Put balls at rest on the floor to sleep
+        resting = floor & ~walls & (np.abs(balls.velocity[:, 0]) < SLEEP_SPEED) \
+            & (np.abs(balls.velocity[:, 1]) < SLEEP_BOUNCE)
+        if resting.any():
+            self.sleeping.add(balls.position[resting], balls.velocity[resting] * 0, balls.color[resting],
+                              balls.radius[resting], sprite=balls.sprite[resting])
+            balls.remove(resting)
+
+    def draw(self, target):
+        # The floor layer holds the sleeping balls, only balls that fell asleep since the last frame are added
+        if self._layer is None or self._layer.get_size() != target.get_size():
+            self._layer = pygame.Surface(target.get_size(), 0, target)
+            self._layer.fill(self.bg_color)
+            self._baked = 0
+        if self._baked < len(self.sleeping):
+            self.sprites.draw_particles(self._layer, self.sleeping, rows=slice(self._baked, None))
+            self._baked = len(self.sleeping)
+        target.blit(self._layer, (0, 0))
+        self.sprites.draw_particles(target, self.balls)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <path_to_audio_file>")
-        sys.exit(1)
+    import sys
+
+    import render
 
-    audio_path = sys.argv[1]
-    main(audio_path)
+    render.main(["falling_balls"] + sys.argv[1:])
@@ -1,9 +1,9 @@
-import pygame
 import random
-import time
-import subprocess
-from moviepy.editor import ImageSequenceClip, AudioFileClip
-import sys
+from itertools import repeat
+
+from particles import Particles
+from scene import Scene
+from sprites import CircleSprites
 
 # Constants
 SCREEN_WIDTH = 1080
@@ -21,95 +21,44 @@ def random_color():
     return (random.randint(100, 255), random.randint(100, 255), random.randint(100, 255))
 
 
-class Firefly:
-    def __init__(self, x, y, vx, vy, color):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.color = color
-
-    def update(self):
-        self.x += self.vx
-        self.y += self.vy
+class Fireflies(Scene):
+    title = "Firefly Animation"
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    fps = FPS
+    bg_color = BG_COLOR
+    output = "firefly_animation_with_audio.mp4"
+    num_fireflies = NUM_FIREFLIES
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.sprites = CircleSprites(antialias=self.antialias, scale=self.scale)
+        self.fireflies = Particles(capacity=self.num_fireflies, sprite=object)
+        for _ in range(self.num_fireflies):
+            position = (random.randint(FIREFLY_RADIUS, SCREEN_WIDTH - FIREFLY_RADIUS),
+                        random.randint(FIREFLY_RADIUS, SCREEN_HEIGHT - FIREFLY_RADIUS))
+            velocity = (random.uniform(-MAX_VELOCITY, MAX_VELOCITY), random.uniform(-MAX_VELOCITY, MAX_VELOCITY))
+            color = random_color()
+            self.fireflies.add(position, velocity, color, FIREFLY_RADIUS, sprite=self.sprites.get(FIREFLY_RADIUS, color))
+
+    def update(self, dt):
+        self.fireflies.integrate()
 
         # Bounce off the walls
-        if self.x + FIREFLY_RADIUS > SCREEN_WIDTH or self.x - FIREFLY_RADIUS < 0:
-            self.vx = -self.vx
-        if self.y + FIREFLY_RADIUS > SCREEN_HEIGHT or self.y - FIREFLY_RADIUS < 0:
-            self.vy = -self.vy
-
-    def draw(self, screen):
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), FIREFLY_RADIUS)
-        pygame.draw.circle(screen, GLOW_COLOR, (int(self.x), int(self.y)), FIREFLY_RADIUS * 3, 1)
-
-
-def get_audio_duration(audio_path):
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1",
-         audio_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    return float(result.stdout)
-
-
-def main(audio_path):
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.HIDDEN)
-    pygame.display.set_caption("Firefly Animation")
-    clock = pygame.time.Clock()
-
-    fireflies = [Firefly(
-        random.randint(FIREFLY_RADIUS, SCREEN_WIDTH - FIREFLY_RADIUS),
-        random.randint(FIREFLY_RADIUS, SCREEN_HEIGHT - FIREFLY_RADIUS),
-        random.uniform(-MAX_VELOCITY, MAX_VELOCITY),
-        random.uniform(-MAX_VELOCITY, MAX_VELOCITY),
-        random_color()
-    ) for _ in range(NUM_FIREFLIES)]
-
-    # Get the audio duration
-    audio_duration = get_audio_duration(audio_path)
-    frames = []
-    running = True
-    start_time = time.time()
-
-    while running and (time.time() - start_time) < audio_duration:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        screen.fill(BG_COLOR)
-
-        for firefly in fireflies:
-            firefly.update()
-            firefly.draw(screen)
-
-        # Capture the current frame
-        frame = pygame.surfarray.array3d(screen)
-        frame = frame.transpose([1, 0, 2])  # Convert from (width, height, colors) to (height, width, colors)
-        frames.append(frame)
-
-        pygame.display.flip()
-        clock.tick(FPS)
-
-    pygame.quit()
-
-    # Save the captured frames as a video file
-    clip = ImageSequenceClip(frames, fps=FPS)
-
-    # Load the audio file
-    try:
-        audio_clip = AudioFileClip(audio_path)
-        final_clip = clip.set_audio(audio_clip)
-        final_clip.write_videofile("firefly_animation_with_audio.mp4", codec="libx264", audio_codec="aac")
-    except Exception as e:
-        print(f"Error loading audio file: {e}")
+        self.fireflies.bounce(0, 0, SCREEN_WIDTH, clamp=False, inclusive=False)
+        self.fireflies.bounce(1, 0, SCREEN_HEIGHT, clamp=False, inclusive=False)
+
+    def draw(self, target):
+        target.fill(self.bg_color)
+        positions = self.fireflies.pixel_positions(self.scale)
+        bodies = zip(self.fireflies.sprite.tolist(), (positions - self.sprites.scaled(FIREFLY_RADIUS)).tolist())
+        glow = self.sprites.get(FIREFLY_RADIUS * 3, GLOW_COLOR, width=1)
+        glows = zip(repeat(glow), (positions - self.sprites.scaled(FIREFLY_RADIUS * 3)).tolist())
+        # Each firefly's glow ring goes on top of its body, before the next firefly
+        target.blits([blit for pair in zip(bodies, glows) for blit in pair], doreturn=False)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <path_to_audio_file>")
-        sys.exit(1)
+    import sys
+
+    import render
 
-    audio_path = sys.argv[1]
-    main(audio_path)
+    render.main(["fireflies"] + sys.argv[1:])
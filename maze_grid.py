@@ -0,0 +1,96 @@
+import random
+
+import numpy as np
+
+import maze_solver
+
+WALL = 0
+PASSAGE = 1
+
+
+class MazeGrid:
+    # Maze as one byte per cell (0 wall, 1 passage) in a flat row-major bytearray, grid is a (height, width)
+    # NumPy view of it. Passages are carved between cells with odd coordinates.
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = bytearray(width * height)
+        self.grid = np.frombuffer(self.cells, np.uint8).reshape(height, width)
+        self.carve_order = np.zeros(0, np.int64)  # Flat indices in the order generate() opened them
+        self.seed = None  # Seed the maze was carved from, if it was given one
+
+    def __len__(self):
+        return len(self.cells)
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def is_passage(self, x, y):
+        return self.cells[y * self.width + x] == PASSAGE
+
+    def odd_corners(self):
+        # The first and last cells the generator carves through, the natural start and end of a path
+        return (1, 1), (self.width - 1 if self.width % 2 == 0 else self.width - 2,
+                        self.height - 1 if self.height % 2 == 0 else self.height - 2)
+
+    def solve(self, start, end, method=maze_solver.DEFAULT_SOLVER):
+        # Shortest path from start to end as flat indices, see maze_solver.py
+        return maze_solver.solve(self, start, end, method)
+
+    def generate(self, rng=random, seed=None):
+        # Iterative recursive backtracker. Visited cells are flags in a bytearray, so every check is O(1)
+        # and generation is linear in the number of cells. Candidates are drawn with rng.choice in the same
+        # order the sprite maze used, so a seed carves the same maze it did. A maze carved from its own seed
+        # is the same every time, which lets its solved paths be cached.
+        if seed is not None:
+            rng = random.Random(seed)
+        self.seed = seed
+        width, height = self.width, self.height
+        cells = self.cells
+        cells[:] = bytes(len(cells))
+        visited = bytearray(len(cells))
+        # The sprite maze started from the last odd cell in column-major order
+        x = width - 1 if width % 2 == 0 else width - 2
+        y = height - 1 if height % 2 == 0 else height - 2
+        if x < 1 or y < 1:
+            self.carve_order = np.zeros(0, np.int64)
+            return self.carve_order
+        current = y * width + x
+        remaining = ((width // 2) * (height // 2)) - 1
+        visited[current] = 1
+        cells[current] = PASSAGE
+        order = [current]
+        stack = []
+        choice = rng.choice
+        row = 2 * width
+
+        while remaining:
+            y, x = divmod(current, width)
+            candidates = []
+            if x >= 2 and not visited[current - 2]:
+                candidates.append(current - 2)
+            if y >= 2 and not visited[current - row]:
+                candidates.append(current - row)
+            if x + 2 < width and not visited[current + 2]:
+                candidates.append(current + 2)
+            if y + 2 < height and not visited[current + row]:
+                candidates.append(current + row)
+            if not candidates:
+                if not stack:
+                    break
+                current = stack.pop()
+                continue
+
+            following = choice(candidates)
+            stack.append(current)
+            between = (current + following) // 2
+            cells[between] = PASSAGE
+            cells[following] = PASSAGE
+            visited[following] = 1
+            order.append(between)
+            order.append(following)
+            current = following
+            remaining -= 1
+
+        self.carve_order = np.array(order, np.int64)
+        return self.carve_order
@@ -0,0 +1,195 @@
+import os
+from array import array
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from atomic import atomic_write
+from audio import CACHE_DIR
+
+SOLVERS_VERSION = 1  # Bump when the generator or the solvers change, so stale cached paths are solved again
+MAX_CACHED_PATHS = 16  # Paths kept in memory, on top of the ones cached on disk
+MAX_PATH_CACHE_BYTES = 256 * 1024 ** 2  # Least recently used path files are dropped beyond this
+PATH_CACHE_DIR = os.path.join(CACHE_DIR, "maze_paths")
+NOT_SEEN = -1
+
+_paths = OrderedDict()
+
+
+def padded(maze):
+    # Copy of the cells with a wall border around them, so a neighbour is always index + offset with no bounds
+    # checks. Search marks cells it has reached by clearing them in this copy.
+    width = maze.width + 2
+    grid = np.zeros((maze.height + 2, width), np.uint8)
+    grid[1:-1, 1:-1] = maze.grid
+    return bytearray(grid.tobytes()), width
+
+
+def to_padded(cell, width):
+    return (cell[1] + 1) * width + cell[0] + 1
+
+
+def from_padded(path, maze, width):
+    # Padded indices to flat indices of the maze
+    path = np.asarray(path, np.int64)
+    y, x = np.divmod(path, width)
+    return (y - 1) * maze.width + x - 1
+
+
+def walk_back(parent, cell, stop):
+    # Parent links from cell back to stop, stop included
+    path = [cell]
+    while cell != stop:
+        cell = parent[cell]
+        path.append(cell)
+    return path
+
+
+def bfs(maze, start, end):
+    # Breadth-first search, shortest path in steps
+    cells, width = padded(maze)
+    source, target = to_padded(start, width), to_padded(end, width)
+    if not cells[source] or not cells[target]:
+        return np.zeros(0, np.int64)
+    parent = array("i", [NOT_SEEN]) * len(cells)
+    cells[source] = 0
+    queue = deque([source])
+    pop, push = queue.popleft, queue.append
+    offsets = (-1, 1, -width, width)
+    while queue:
+        current = pop()
+        if current == target:
+            return from_padded(walk_back(parent, target, source)[::-1], maze, width)
+        for offset in offsets:
+            following = current + offset
+            if cells[following]:
+                cells[following] = 0
+                parent[following] = current
+                push(following)
+    return np.zeros(0, np.int64)
+
+
+def bidirectional(maze, start, end):
+    # Breadth-first from both ends at once, always growing the smaller frontier, until the two meet. In a
+    # maze this explores far fewer cells than searching from one end.
+    cells, width = padded(maze)
+    source, target = to_padded(start, width), to_padded(end, width)
+    if not cells[source] or not cells[target]:
+        return np.zeros(0, np.int64)
+    if source == target:
+        return from_padded([source], maze, width)
+    # 1 is an open cell nobody reached yet, 2 and 3 are cells reached from the source and from the target
+    cells[source], cells[target] = 2, 3
+    parent = array("i", [NOT_SEEN]) * len(cells)
+    frontiers = {2: [source], 3: [target]}
+    offsets = (-1, 1, -width, width)
+    while frontiers[2] and frontiers[3]:
+        side = 2 if len(frontiers[2]) <= len(frontiers[3]) else 3
+        other = 5 - side
+        reached = []
+        for current in frontiers[side]:
+            for offset in offsets:
+                following = current + offset
+                owner = cells[following]
+                if owner == 1:
+                    cells[following] = side
+                    parent[following] = current
+                    reached.append(following)
+                elif owner == other:
+                    # The searches met between current and following
+                    if side == 3:
+                        current, following = following, current
+                    path = walk_back(parent, current, source)[::-1] + walk_back(parent, following, target)
+                    return from_padded(path, maze, width)
+        frontiers[side] = reached
+    return np.zeros(0, np.int64)
+
+
+SOLVERS = {"bfs": bfs, "bidirectional": bidirectional}
+DEFAULT_SOLVER = "bidirectional"
+
+
+def is_valid_path(maze, path, start, end):
+    # True if the path of flat indices goes from start to end one step at a time through passages only
+    path = np.asarray(path, np.int64)
+    if not len(path) or path[0] != maze.index(*start) or path[-1] != maze.index(*end):
+        return False
+    if path.min() < 0 or path.max() >= len(maze):
+        return False
+    if not maze.grid.reshape(-1)[path].all():
+        return False
+    steps = np.diff(path)
+    horizontal = np.abs(steps) == 1
+    # A step of one index is only a move if it doesn't wrap around to another row
+    same_row = path[:-1] // maze.width == path[1:] // maze.width
+    return bool(np.all((horizontal & same_row) | (np.abs(steps) == maze.width)))
+
+
+def cache_path(maze, start, end):
+    return os.path.join(PATH_CACHE_DIR, "%dx%d-seed%d-%d_%d-%d_%d.v%d.npy"
+                        % (maze.width, maze.height, maze.seed, start[0], start[1], end[0], end[1], SOLVERS_VERSION))
+
+
+def evict_paths(keep, max_bytes=MAX_PATH_CACHE_BYTES):
+    # Drops the least recently used path files until the cache fits, never keep, the one just written. A path read from disk is touched, so the
+    # modification time is the last use. Another process may be evicting at the same time.
+    entries = []
+    for entry in os.scandir(PATH_CACHE_DIR):
+        if not entry.name.endswith(".npy"):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def solve(maze, start, end, method=DEFAULT_SOLVER, use_cache=True):
+    # Path of flat indices from start to end, empty if there is none. Every solver finds a shortest path, and a
+    # maze carved from a known seed is the same maze every time, so its paths are cached in memory and on disk
+    # per (seed, start, end): repeat renders and the workers of a parallel render solve it once.
+    if method not in SOLVERS:
+        raise ValueError("Unknown solver %r, choose from: %s" % (method, ", ".join(sorted(SOLVERS))))
+    solver = SOLVERS[method]
+    start, end = tuple(start), tuple(end)
+    if not use_cache or maze.seed is None:
+        return solver(maze, start, end)
+
+    key = (maze.width, maze.height, maze.seed, start, end)
+    path = _paths.get(key)
+    if path is not None:
+        _paths.move_to_end(key)
+        return path
+    filename = cache_path(maze, start, end)
+    try:
+        path = np.load(filename)
+        if len(path) and not is_valid_path(maze, path, start, end):
+            path = None  # From another version of the generator
+        else:
+            os.utime(filename)
+    except (OSError, ValueError):
+        path = None
+    if path is None:
+        path = solver(maze, start, end)
+        try:
+            os.makedirs(PATH_CACHE_DIR, exist_ok=True)
+            with atomic_write(filename, "wb") as f:
+                np.save(f, path)
+            evict_paths(filename)
+        except OSError:
+            pass
+    _paths[key] = path
+    if len(_paths) > MAX_CACHED_PATHS:
+        _paths.popitem(last=False)
+    return path
@@ -1,10 +1,11 @@
-import pygame
 import random
-import math
-import time
-import subprocess
-from moviepy.editor import ImageSequenceClip, AudioFileClip
-import sys
+
+import numpy as np
+
+from particles import Particles
+from scene import Scene
+from sprites import CircleSprites
+from spatial_hash import SpatialHash
 
 # Constants
 SCREEN_WIDTH = 1080
@@ -19,104 +20,56 @@ FPS = 60  # Frames per second for the video
 def random_color():
     return (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
 
-class Molecule:
-    def __init__(self, x, y, vx, vy, color):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.color = color
-
-    def update(self, molecules):
-        self.x += self.vx
-        self.y += self.vy
+class Molecules(Scene):
+    title = "Molecular Dynamics Simulation"
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    fps = FPS
+    bg_color = BG_COLOR
+    output = "molecular_dynamics_with_audio.mp4"
+    num_molecules = NUM_MOLECULES
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.sprites = CircleSprites(antialias=self.antialias, scale=self.scale)
+        self.molecules = Particles(capacity=self.num_molecules, sprite=object)
+        for _ in range(self.num_molecules):
+            position = (random.randint(MOLECULE_RADIUS, SCREEN_WIDTH - MOLECULE_RADIUS),
+                        random.randint(MOLECULE_RADIUS, SCREEN_HEIGHT - MOLECULE_RADIUS))
+            velocity = (random.uniform(-MAX_VELOCITY, MAX_VELOCITY), random.uniform(-MAX_VELOCITY, MAX_VELOCITY))
+            color = random_color()
+            self.molecules.add(position, velocity, color, MOLECULE_RADIUS, sprite=self.sprites.get(MOLECULE_RADIUS, color))
+        # Molecules only collide when closer than 2 * radius, so that is the grid cell size
+        self.grid = SpatialHash(2 * MOLECULE_RADIUS)
+
+    def update(self, dt):
+        molecules = self.molecules
+        molecules.integrate()
 
         # Bounce off the walls
-        if self.x + MOLECULE_RADIUS > SCREEN_WIDTH or self.x - MOLECULE_RADIUS < 0:
-            self.vx = -self.vx
-        if self.y + MOLECULE_RADIUS > SCREEN_HEIGHT or self.y - MOLECULE_RADIUS < 0:
-            self.vy = -self.vy
+        molecules.bounce(0, 0, SCREEN_WIDTH, clamp=False, inclusive=False)
+        molecules.bounce(1, 0, SCREEN_HEIGHT, clamp=False, inclusive=False)
 
         # Handle collisions with other molecules
-        for molecule in molecules:
-            if molecule != self:
-                dx = self.x - molecule.x
-                dy = self.y - molecule.y
-                distance = math.sqrt(dx ** 2 + dy ** 2)
-                if distance < MOLECULE_RADIUS * 2:
-                    # Simple elastic collision response
-                    angle = math.atan2(dy, dx)
-                    self.vx, self.vy = -self.vx, -self.vy
-                    molecule.vx, molecule.vy = -molecule.vx, -molecule.vy
-
-    def draw(self, screen):
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), MOLECULE_RADIUS)
-
-def get_audio_duration(audio_path):
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1",
-         audio_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    return float(result.stdout)
-
-def main(audio_path):
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.HIDDEN)
-    pygame.display.set_caption("Molecular Dynamics Simulation")
-    clock = pygame.time.Clock()
-
-    molecules = [Molecule(
-        random.randint(MOLECULE_RADIUS, SCREEN_WIDTH - MOLECULE_RADIUS),
-        random.randint(MOLECULE_RADIUS, SCREEN_HEIGHT - MOLECULE_RADIUS),
-        random.uniform(-MAX_VELOCITY, MAX_VELOCITY),
-        random.uniform(-MAX_VELOCITY, MAX_VELOCITY),
-        random_color()
-    ) for _ in range(NUM_MOLECULES)]
+        self.collide(*self.grid.pairs(molecules.position))
 
-    # Get the audio duration
-    audio_duration = get_audio_duration(audio_path)
-    frames = []
-    running = True
-    start_time = time.time()
+    def collide(self, first, second):
+        molecules = self.molecules
+        delta = molecules.position[first] - molecules.position[second]
+        close = np.hypot(delta[:, 0], delta[:, 1]) < MOLECULE_RADIUS * 2
 
-    while running and (time.time() - start_time) < audio_duration:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+        # Simple elastic collision response: each touching pair reverses both molecules once,
+        # so a molecule touching an even number of others ends up unchanged
+        touching = np.bincount(np.concatenate((first[close], second[close])), minlength=len(molecules))
+        flip = touching % 2 == 1
+        molecules.velocity[flip] = -molecules.velocity[flip]
 
-        screen.fill(BG_COLOR)
-
-        for molecule in molecules:
-            molecule.update(molecules)
-            molecule.draw(screen)
-
-        # Capture the current frame
-        frame = pygame.surfarray.array3d(screen)
-        frame = frame.transpose([1, 0, 2])  # Convert from (width, height, colors) to (height, width, colors)
-        frames.append(frame)
-
-        pygame.display.flip()
-        clock.tick(FPS)
-
-    pygame.quit()
-
-    # Save the captured frames as a video file
-    clip = ImageSequenceClip(frames, fps=FPS)
-
-    # Load the audio file
-    try:
-        audio_clip = AudioFileClip(audio_path)
-        final_clip = clip.set_audio(audio_clip)
-        final_clip.write_videofile("molecular_dynamics_with_audio.mp4", codec="libx264", audio_codec="aac")
-    except Exception as e:
-        print(f"Error loading audio file: {e}")
+    def draw(self, target):
+        target.fill(self.bg_color)
+        self.sprites.draw_particles(target, self.molecules)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <path_to_audio_file>")
-        sys.exit(1)
+    import sys
+
+    import render
 
-    audio_path = sys.argv[1]
-    main(audio_path)
+    render.main(["molecules"] + sys.argv[1:])
@@ -0,0 +1,150 @@
+import math
+import multiprocessing
+import os
+import random
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+from audio import get_audio_duration
+from audio_features import load_features
+from capture import SurfaceCapture, pixel_format
+from encoder import FFmpegWriter
+from postfx import STATEFUL_EFFECTS, parse_effects
+from render import encoder_options, frame_step, load_scene, post_effects
+
+CHUNK_SIZE = 8  # Frames rendered per task
+MAX_BUFFERED_FRAMES = 256  # Upper bound on rendered frames held in shared memory waiting for the encoder
+IN_FLIGHT_PER_WORKER = 2  # Chunks queued per worker, the ring holds this many chunks per worker
+SHM_DIR = "/dev/shm"  # Where POSIX shared memory lives on Linux
+
+# Per-worker state, set up once by init_worker
+_scene = None
+_screen = None
+_capture = None
+_fx = None
+_shm = None
+_slots = None
+
+
+def frame_slots(shm, size):
+    # The shared block as one row of packed pixels per frame slot
+    width, height = size
+    return np.ndarray((shm.size // (width * height * 4), width * height * 4), np.uint8, shm.buf)
+
+
+def check_shm_space(size):
+    # Shared memory that doesn't fit kills the workers with SIGBUS once they touch it, fail up front instead.
+    # Docker gives containers 64 MB of /dev/shm unless run with a larger --shm-size.
+    try:
+        free = shutil.disk_usage(SHM_DIR).free
+    except OSError:
+        return  # No /dev/shm to check, e.g. macOS
+    if size > free:
+        raise ValueError("The parallel frame buffer needs %d MB of shared memory but %s has %d MB free. Use fewer "
+                         "--workers or a lower resolution, or give a container more with --shm-size"
+                         % (math.ceil(size / 2 ** 20), SHM_DIR, free // 2 ** 20))
+
+
+def init_worker(scene_name, audio_path, seed, params, total_frames, step, shm_name):
+    global _scene, _screen, _capture, _fx, _shm, _slots
+    # Every worker builds the scene from the same seed, so they all agree on its initial state
+    random.seed(seed)
+    _scene = load_scene(scene_name)(**params)
+    _scene.start(total_frames)
+    if _scene.reactive:
+        # Memory-mapped, so the workers share the cached features through the page cache
+        _scene.features = load_features(audio_path, _scene.fps)
+    # Headless surface, no display needed in the workers
+    _screen = pygame.Surface(_scene.output_size, 0, 32)
+    _fx = post_effects(_scene, _screen, step)
+    _capture = SurfaceCapture(_fx.output if _fx else _screen)
+    _shm = shared_memory.SharedMemory(shm_name)
+    _slots = frame_slots(_shm, _scene.output_size)
+
+
+def render_chunk(start, end, step=1, first_slot=0):
+    # Renders straight into the shared frame slots from first_slot on and returns how many it filled, only
+    # the count goes back through the pool
+    count = 0
+    for count, frame in enumerate(range(start, end, step), 1):
+        # Video frame k shows the scene after k + 1 updates
+        _scene.seek(frame + 1)
+        _scene.draw(_screen)
+        if _fx:
+            _fx.apply(_screen)
+        # Raw pixels in the surface's own layout, the encoder is told that layout
+        _capture.copy_to(_slots[first_slot + count - 1])
+    return count
+
+
+def render_parallel(scene_name, audio_path, output=None, seed=None, params=None, frame_range=None, workers=None,
+                    chunk_size=CHUNK_SIZE, max_buffered_frames=MAX_BUFFERED_FRAMES, profile=None, preview_fps=None):
+    # Splits the timeline into chunks rendered by a pool of worker processes and feeds the results to the
+    # encoder in strict frame order. Only scenes with random access can be rendered this way, since every
+    # chunk has to be able to start from an arbitrary frame.
+    params = params or {}
+    scene_class = load_scene(scene_name)
+    if not scene_class.random_access:
+        raise ValueError("%s can't be rendered in parallel, it has no random access to its frames" % scene_name)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    workers = workers or os.cpu_count()
+
+    scene = scene_class(**params)
+    if STATEFUL_EFFECTS.intersection(parse_effects(scene.effects)):
+        raise ValueError("%s can't be rendered in parallel with %s, each frame depends on the ones before it"
+                         % (scene_name, scene.effects))
+    fps = scene.fps
+    if scene.reactive:
+        load_features(audio_path, fps)  # Analysed once here rather than by every worker
+    total_frames = math.ceil(get_audio_duration(audio_path) * fps)
+    start_frame, end_frame = frame_range or (0, None)
+    end_frame = min(total_frames, end_frame) if end_frame is not None else total_frames
+    chunk_size = max(min(chunk_size, max_buffered_frames), 1)  # A chunk can't hold more than the buffer
+    # Previews only render every step-th frame, a chunk still holds chunk_size rendered frames
+    step = frame_step(fps, preview_fps)
+    span = chunk_size * step
+    chunks = deque((start, min(start + span, end_frame), step) for start in range(start_frame, end_frame, span))
+
+    # Frames are rendered into a ring of shared memory slots, chunk_size per chunk in flight, and encoded from
+    # there, so no pixels are pickled and the ring bounds memory. The reorder buffer is the queue of submitted
+    # chunks: a chunk's slots are only handed out again once the oldest chunk has been encoded. Two chunks per
+    # worker keep every worker busy while the oldest chunk is encoded.
+    max_in_flight = max(min(IN_FLIGHT_PER_WORKER * workers, max_buffered_frames // chunk_size), 1)
+    width, height = scene.output_size
+    ring_bytes = max_in_flight * chunk_size * width * height * 4
+    check_shm_space(ring_bytes)
+    shm = shared_memory.SharedMemory(create=True, size=ring_bytes)
+    slots = frame_slots(shm, scene.output_size)
+    context = multiprocessing.get_context("spawn")
+    pix_fmt = pixel_format(pygame.Surface(scene.output_size, 0, 32))  # Same layout as the workers' surfaces
+    try:
+        with FFmpegWriter(output or scene.output, scene.output_size, fps / step, audio_path=audio_path,
+                          audio_start=start_frame / fps, pix_fmt=pix_fmt,
+                          **encoder_options(scene, profile)) as writer, \
+                ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                    initargs=(scene_name, audio_path, seed, params, total_frames, step,
+                                              shm.name)) as pool:
+            pending = deque()
+            submitted = 0
+            while chunks or pending:
+                while chunks and len(pending) < max_in_flight:
+                    first_slot = submitted % max_in_flight * chunk_size
+                    pending.append((pool.submit(render_chunk, *chunks.popleft(), first_slot), first_slot))
+                    submitted += 1
+                # Chunks finish out of order, but we always wait on the oldest one
+                future, first_slot = pending.popleft()
+                for slot in range(first_slot, first_slot + future.result()):
+                    writer.write_frame(slots[slot])
+    finally:
+        del slots  # The block can't be closed while an array still points into it
+        shm.close()
+        shm.unlink()
+
+    print(writer.report())
+    return len(range(start_frame, end_frame, step))
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Every particle has these, extra per-particle scalars can be added with Particles(**fields)
+FIELDS = {
+    "position": ((2,), np.float64),
+    "velocity": ((2,), np.float64),
+    "color": ((3,), np.uint8),
+    "radius": ((), np.float64),
+}
+
+
+class Particles:
+    # Struct-of-arrays particle store: each field is a NumPy array the scenes update with vectorized operations.
+    # Removed particles free their slots for the next add.
+    def __init__(self, capacity=256, **fields):
+        self.count = 0
+        self._fields = dict(FIELDS)
+        for name, dtype in fields.items():
+            self._fields[name] = ((), dtype)
+        self._arrays = {name: np.zeros((capacity,) + shape, dtype) for name, (shape, dtype) in self._fields.items()}
+
+    def __len__(self):
+        return self.count
+
+    def __getstate__(self):
+        # Object fields hold derived data like sprites, which can't be pickled. They are left empty and the
+        # owner fills them in again after loading.
+        state = self.__dict__.copy()
+        state["_arrays"] = {name: np.empty(len(array), object) if array.dtype == object else array
+                            for name, array in self._arrays.items()}
+        return state
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get("_arrays")
+        if arrays is None or name not in arrays:
+            raise AttributeError(name)
+        return arrays[name][:self.count]
+
+    @property
+    def capacity(self):
+        return len(self._arrays["position"])
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name, array in self._arrays.items():
+            grown = np.zeros((capacity,) + array.shape[1:], array.dtype)
+            grown[:self.count] = array[:self.count]
+            self._arrays[name] = grown
+
+    def add(self, position, velocity, color, radius, **fields):
+        # Accepts a single particle or k particles as (k, 2) / (k, 3) / (k,) arrays, returns their indices
+        position = np.asarray(position, np.float64).reshape(-1, 2)
+        k = len(position)
+        start = self.count
+        self.reserve(start + k)
+        self.count = start + k
+        rows = slice(start, start + k)
+        self._arrays["position"][rows] = position
+        self._arrays["velocity"][rows] = np.asarray(velocity, np.float64).reshape(-1, 2)
+        color = np.asarray(color)
+        self._arrays["color"][rows] = color.reshape(-1, color.shape[-1])[:, :3]  # Drops alpha from pygame.Color
+        self._arrays["radius"][rows] = radius
+        for name, value in fields.items():
+            self._arrays[name][rows] = value
+        return np.arange(start, start + k)
+
+    def remove(self, mask):
+        # Drops the particles where mask is True. Survivors keep their order, which is the order they're drawn in.
+        keep = ~np.asarray(mask, bool)
+        count = int(keep.sum())
+        if count == self.count:
+            return
+        for name, array in self._arrays.items():
+            array[:count] = array[:self.count][keep]
+            if array.dtype == object:
+                array[count:self.count] = None  # Freed slots don't hold on to sprites
+        self.count = count
+
+    def integrate(self):
+        self.position[:] += self.velocity
+
+    def bounce(self, axis, low, high, elasticity=1.0, clamp=True, inclusive=True):
+        # Reflects the velocity of every particle whose edge touches (inclusive) or crosses a wall on the
+        # given axis and optionally clamps it back inside. Pass None for a side that has no wall.
+        # Returns the boolean mask of particles that hit.
+        position = self.position[:, axis]
+        velocity = self.velocity[:, axis]
+        radius = self.radius
+        hit = np.zeros(self.count, bool)
+        if low is not None:
+            hit |= position - radius <= low if inclusive else position - radius < low
+        if high is not None:
+            hit |= position + radius >= high if inclusive else position + radius > high
+        if not hit.any():
+            return hit
+
+        if elasticity == 1.0:
+            velocity[hit] = -velocity[hit]
+        else:
+            velocity[hit] = -velocity[hit] * elasticity
+        if clamp:
+            position[hit] = np.clip(position[hit],
+                                    -np.inf if low is None else low + radius[hit],
+                                    np.inf if high is None else high - radius[hit])
+        return hit
+
+    def pixel_positions(self, scale=1.0):
+        # Truncated toward zero like int(), which is what pygame.draw got before. scale maps the simulation's
+        # coordinates onto a smaller drawing surface.
+        position = self.position if scale == 1 else self.position * scale
+        return position.astype(np.int64)
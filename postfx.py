@@ -0,0 +1,118 @@
+import numpy as np
+import pygame
+
+EFFECTS = ["trails", "glow", "bloom", "vignette"]  # In the order they are applied
+TRAIL_DECAY = 0.85  # Part of a trail's brightness left after each frame
+GLOW_STRENGTH = 0.8  # How much of the blurred frame is added back
+BLOOM_THRESHOLD = 150.0  # Channel value above which light blooms
+BLOOM_STRENGTH = 2.0
+DOWNSAMPLE = 8  # Glow and bloom are blurred at 1/DOWNSAMPLE of the frame's resolution
+BLUR_RADIUS = 3  # Box blur radius in downsampled pixels
+BLUR_PASSES = 3  # Box blurs per axis, three are close to a Gaussian
+VIGNETTE_STRENGTH = 0.55  # Darkening in the corners
+STATEFUL_EFFECTS = {"trails"}  # Effects that carry light over from one frame to the next
+
+
+def parse_effects(value):
+    # "glow,trails" -> ["trails", "glow"], in the order they are applied
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in EFFECTS]
+    if unknown:
+        raise ValueError("Unknown effect %r, choose from: %s" % (unknown[0], ", ".join(EFFECTS)))
+    return [name for name in EFFECTS if name in names]
+
+
+class PostFX:
+    # Whole-frame effects, applied into output, a copy of the drawn surface, so they never stack up on scenes
+    # that only redraw what changed. All buffers are allocated up front.
+    def __init__(self, surface, effects, scale=1.0, step=1):
+        self.effects = parse_effects(effects) if isinstance(effects, str) else list(effects)
+        self.size = width, height = surface.get_size()
+        self.output = pygame.Surface(self.size, 0, surface)
+
+        self.trails = None
+        if "trails" in self.effects:
+            self.trails = pygame.Surface(self.size, 0, surface)
+            self.trails.fill((0, 0, 0))
+            # Multiplying by this surface scales every channel by the decay
+            decay = int(round(255 * TRAIL_DECAY ** step))
+            self.decay = pygame.Surface(self.size, 0, surface)
+            self.decay.fill((decay, decay, decay))
+
+        # Glow and bloom buffers: the downsampled frame, its float copy that gets blurred, and the blurred light
+        # upsampled to the frame's size
+        factor = max(DOWNSAMPLE * scale, 1)
+        self.radius = max(int(round(BLUR_RADIUS * DOWNSAMPLE * scale / factor)), 1)
+        small = (max(int(round(width / factor)), 1), max(int(round(height / factor)), 1))
+        self.small = pygame.Surface(small, 0, surface)
+        self.light = np.zeros((small[1], small[0], 4), np.float32)
+        self.upsampled = pygame.Surface(self.size, 0, surface)
+        # Zero-padded copies and running sums for the box blur along each axis
+        r = self.radius
+        self.padded = [np.zeros((small[1] + 2 * r, small[0], 4), np.float32),
+                       np.zeros((small[1], small[0] + 2 * r, 4), np.float32)]
+        self.sums = [np.zeros((small[1] + 2 * r + 1, small[0], 4), np.float32),
+                     np.zeros((small[1], small[0] + 2 * r + 1, 4), np.float32)]
+
+        self.vignette = None
+        if "vignette" in self.effects:
+            y, x = np.ogrid[-1:1:height * 1j, -1:1:width * 1j]
+            distance = np.minimum((x * x + y * y) / 2, 1)
+            shade = np.rint(255 * (1 - VIGNETTE_STRENGTH * distance * distance)).astype(np.uint8)
+            self.vignette = pygame.Surface(self.size, 0, surface)
+            pygame.surfarray.blit_array(self.vignette, np.repeat(shade.T[:, :, None], 3, axis=2))
+
+    def apply(self, surface):
+        # The drawn frame with the effects on it, in output
+        output = self.output
+        output.blit(surface, (0, 0))
+        for name in self.effects:
+            if name == "trails":
+                self.trails.blit(self.decay, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+                self.trails.blit(output, (0, 0), special_flags=pygame.BLEND_RGB_MAX)
+                output.blit(self.trails, (0, 0))
+            elif name == "glow":
+                self.add_blurred(output, GLOW_STRENGTH)
+            elif name == "bloom":
+                self.add_blurred(output, BLOOM_STRENGTH, BLOOM_THRESHOLD)
+            elif name == "vignette":
+                output.blit(self.vignette, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        return output
+
+    def add_blurred(self, surface, strength, threshold=None):
+        # The effects treat the color channels alike, so the pixels are used in the surface's own byte order
+        pygame.transform.smoothscale(surface, self.small.get_size(), self.small)
+        width, height = self.small.get_size()
+        light = self.light
+        buffer = self.small.get_buffer()
+        try:
+            pixels = np.frombuffer(buffer, np.uint8).reshape(height, -1)[:, :width * 4].reshape(height, width, 4)
+            np.copyto(light, pixels)
+            if threshold is not None:
+                light -= threshold
+                np.maximum(light, 0, out=light)
+            for _ in range(BLUR_PASSES):
+                self.box_blur(light, 0)
+                self.box_blur(light, 1)
+            light *= strength
+            np.minimum(light, 255, out=light)
+            np.copyto(pixels, light, casting="unsafe")
+        finally:
+            del buffer
+        pygame.transform.smoothscale(self.small, self.size, self.upsampled)
+        surface.blit(self.upsampled, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+
+    def box_blur(self, image, axis):
+        # Mean over 2 * radius + 1 pixels along one axis from a running sum, the same cost for any radius.
+        # Past the edges counts as black.
+        r = self.radius
+        n = image.shape[axis]
+        padded, sums = self.padded[axis], self.sums[axis]
+        inner, after_first, ahead, behind = ([slice(None)] * 3 for _ in range(4))
+        inner[axis] = slice(r, r + n)
+        after_first[axis] = slice(1, None)
+        ahead[axis], behind[axis] = slice(2 * r + 1, None), slice(None, n)
+        padded[tuple(inner)] = image
+        np.cumsum(padded, axis=axis, out=sums[tuple(after_first)])
+        np.subtract(sums[tuple(ahead)], sums[tuple(behind)], out=image)
+        image *= 1 / (2 * r + 1)
@@ -0,0 +1,345 @@
+import argparse
+import importlib
+import math
+import os
+import random
+import time
+
+IMPORTED_AT = time.perf_counter()
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from audio import get_audio_duration
+from audio_features import load_features
+from capture import SurfaceCapture
+from encoder import PROFILES, FFmpegWriter, profile_options
+from postfx import EFFECTS, STATEFUL_EFFECTS, PostFX, parse_effects
+
+PREVIEW_SCALE = 0.25  # Drawing scale of --preview renders
+PREVIEW_SUFFIX = "_preview"  # Added to a scene's output name for previews
+
+# Scene name -> "module:Class". Modules are imported on demand so a render only loads what it uses.
+SCENES = {
+    "multiplying_balls": "main:MainState",
+    "repulsing_balls": "repulsing_ball:MainState",
+    "galaxy": "galaxy:Galaxy",
+    "falling_balls": "falling_ball:FallingBalls",
+    "fireflies": "firefly:Fireflies",
+    "molecules": "molecule_ball:Molecules",
+    "maze": "big_ball:MazeScene",
+}
+
+
+def load_scene(name):
+    if name not in SCENES:
+        raise ValueError("Unknown scene %r, choose from: %s" % (name, ", ".join(sorted(SCENES))))
+    module_name, class_name = SCENES[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def encoder_options(scene, profile=None, threads=None):
+    # The scene's own encoder settings, or a named profile applied on top of its codecs. threads overrides the
+    # encoder thread count when several encoders share the machine.
+    options = scene.encoder_options if profile is None else dict(scene.encoder_options, **profile_options(profile))
+    return options if threads is None else dict(options, threads=threads)
+
+
+def frame_step(fps, preview_fps=None):
+    # Previews draw every step-th frame, the simulation still runs every update
+    return max(int(round(fps / preview_fps)), 1) if preview_fps else 1
+
+
+def post_effects(scene, surface, step=1):
+    # The post-processing stage for the scene's effects, None if it has none
+    if not scene.effects:
+        return None
+    return PostFX(surface, scene.effects, scene.scale, step)
+
+
+def seconds_since_launch():
+    # Wall time since the process started, read from /proc where there is one, otherwise since render was imported
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.perf_counter() - IMPORTED_AT
+
+
+def render(scene_name, audio_path, output=None, seed=None, params=None, frame_range=None,
+           profile=None, preview_fps=None, metrics=None, metrics_interval=None, threads=None):
+    job_start = time.perf_counter()
+    scene_class = load_scene(scene_name)
+    if seed is not None:
+        random.seed(seed)
+    scene = scene_class(**(params or {}))
+    fps = scene.fps
+    if scene.reactive:
+        scene.features = load_features(audio_path, fps)
+    dt = 1 / fps
+    step = frame_step(fps, preview_fps)
+
+    # Headless: the scene draws into an offscreen surface, no display or event subsystem is ever initialized
+    screen = pygame.Surface(scene.output_size, 0, 32)
+    fx = post_effects(scene, screen, step)
+    capture = SurfaceCapture(fx.output if fx else screen)  # Effects are captured from their own surface
+
+    # Get the audio duration
+    audio_duration = get_audio_duration(audio_path)
+    total_frames = math.ceil(audio_duration * fps)
+    scene.start(total_frames)
+    start_frame = 0
+
+    if frame_range is not None:
+        # A frame range starts from the scene's state just before its first frame
+        start_frame, end_frame = frame_range
+        total_frames = min(total_frames, end_frame) if end_frame is not None else total_frames
+        if scene.random_access:
+            scene.seek(start_frame)
+        else:
+            for _ in range(start_frame):
+                scene.update(dt)
+    frame_count = start_frame
+
+    telemetry = None
+    if metrics is not None:
+        from telemetry import INTERVAL, Telemetry
+
+        telemetry = Telemetry(metrics, scene_name, total_frames - start_frame, metrics_interval or INTERVAL)
+
+    # Frames are streamed to the encoder as they are produced instead of being kept in memory
+    with FFmpegWriter(output or scene.output, scene.output_size, fps / step, audio_path=audio_path,
+                      audio_start=start_frame / fps, pix_fmt=capture.pix_fmt,
+                      **encoder_options(scene, profile, threads)) as writer:
+        # Exactly ceil(duration * fps) frames as fast as they can be drawn, all timing is simulation time. The
+        # surface is headless, so pacing to the wall clock would only drop frames.
+        while frame_count < total_frames:
+            if telemetry:
+                telemetry.begin()
+                blocked = writer.write_time
+            scene.update(dt)
+            if telemetry:
+                telemetry.mark("update")
+            if (frame_count - start_frame) % step == 0:
+                scene.draw(screen)
+                if fx:
+                    fx.apply(screen)
+                if telemetry:
+                    telemetry.mark("draw")
+
+                # Capture the current frame straight from the surface's pixel buffer
+                capture.write(writer)
+                if telemetry:
+                    telemetry.mark("capture")
+            if telemetry:
+                telemetry.end(writer.write_time - blocked)
+
+            if frame_count == start_frame:
+                print("%s: first frame %.2f s after the job started, %.2f s after launch"
+                      % (scene_name, time.perf_counter() - job_start, seconds_since_launch()))
+            frame_count += 1
+
+    if telemetry:
+        telemetry.write(done=True)
+    print(writer.report())
+    return frame_count - start_frame
+
+
+def parse_frame_range(value):
+    start, sep, end = value.partition(":")
+    try:
+        start = int(start) if start else 0
+        end = int(end) if end else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected START:END frame numbers, got %r" % value)
+    if not sep or start < 0 or (end is not None and end <= start):
+        raise argparse.ArgumentTypeError("expected START:END with 0 <= START < END, got %r" % value)
+    return start, end
+
+
+def parse_param(item):
+    key, sep, value = item.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE, got %r" % item)
+    return key, value
+
+
+def scene_params(scene_name, scene_class, items):
+    # "key=value" applies to every scene that has the parameter, "scene.key=value" only to that scene.
+    # Command line values arrive as strings, so they are converted to the type of the scene's default.
+    params = {}
+    for key, value in items:
+        target, _, name = key.rpartition(".")
+        if target and target != scene_name:
+            continue
+        default = getattr(scene_class, name, None)
+        if default is None:
+            if target:
+                raise ValueError("%s has no parameter %r" % (scene_name, name))
+            continue
+        if isinstance(default, bool):
+            value = value.lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, (int, float)):
+            value = type(default)(value)
+        params[name] = value
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render one or more scenes to video. Several scene/audio pairs can be given to render them "
+                    "in one process, so interpreter and library startup is only paid once per batch.")
+    parser.add_argument("jobs", nargs="+", metavar="SCENE AUDIO",
+                        help="Scene name followed by the path to its audio file, repeated for each render "
+                             "(scenes: %s)" % ", ".join(sorted(SCENES)))
+    parser.add_argument("-o", "--output", help="Output file (only when rendering a single scene)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Accepted for old command lines, every render now draws exactly ceil(duration * FPS) "
+                             "frames as fast as the CPU allows")
+    parser.add_argument("--seed", type=int, help="Seed the random generator for reproducible renders")
+    parser.add_argument("--frames", type=parse_frame_range, metavar="START:END",
+                        help="Render only this range of frames. Scenes with random access (galaxy) jump "
+                             "straight to START, the others simulate up to it without drawing")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Render frames in N worker processes (0 for one per core). Scenes "
+                             "without random access (galaxy has it) need --snapshot-every")
+    parser.add_argument("--snapshot-every", type=int, metavar="FRAMES",
+                        help="Simulate first, snapshotting the scene every FRAMES frames, and draw and encode the "
+                             "segments between snapshots in parallel. An interrupted render resumes from its "
+                             "snapshots when run again")
+    parser.add_argument("--work-dir", help="Where --snapshot-every keeps snapshots and segments "
+                                           "(default: OUTPUT.parts, removed once the render is done)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Render through the render cache, keyed by scene, code, parameters and seed (needs "
+                             "--seed): a cached video only gets the soundtrack muxed in, a longer track only renders "
+                             "the missing tail")
+    parser.add_argument("--profile", choices=PROFILES,
+                        help="Encode profile: draft (ultrafast, for review), balanced (daily batches) or final "
+                             "(slow, CRF 18). Threads are sized to the machine. Defaults to each scene's own settings")
+    parser.add_argument("--preview", action="store_true",
+                        help="Quick preview: the same simulation drawn at 1/4 scale with the draft profile, written "
+                             "next to the scene's output with a %s suffix" % PREVIEW_SUFFIX)
+    parser.add_argument("--scale", type=float,
+                        help="Drawing scale, e.g. 0.5. The simulation always runs at full resolution")
+    parser.add_argument("--preview-fps", type=float, metavar="FPS",
+                        help="Only draw and encode enough frames for this frame rate, the simulation still runs "
+                             "every update")
+    parser.add_argument("--fx", metavar="EFFECTS",
+                        help="Post-process every frame with comma-separated effects: %s. Trails need the frames "
+                             "in order, so they can't be combined with --workers or --snapshot-every"
+                             % ", ".join(EFFECTS))
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Write per-phase frame timings, ETA and memory to PATH every few seconds: JSON lines, "
+                             "or Prometheus text format if PATH ends in .prom. Serial renders only")
+    parser.add_argument("--metrics-interval", type=float, metavar="SECONDS",
+                        help="Seconds between metric writes (default 5)")
+    parser.add_argument("--set", dest="params", action="append", type=parse_param, metavar="KEY=VALUE",
+                        help="Override a scene parameter, e.g. --set max_balls=5000 or --set galaxy.num_stars=1000")
+    args = parser.parse_args(argv)
+
+    if len(args.jobs) % 2:
+        parser.error("expected SCENE AUDIO pairs")
+    jobs = list(zip(args.jobs[::2], args.jobs[1::2]))
+    if args.output and len(jobs) > 1:
+        parser.error("--output can only be used with a single scene")
+    if args.scale is not None and not 0 < args.scale <= 1:
+        parser.error("--scale must be in (0, 1]")
+    if args.preview_fps is not None and args.preview_fps <= 0:
+        parser.error("--preview-fps must be positive")
+    if args.fx is not None:
+        try:
+            args.fx = ",".join(parse_effects(args.fx))
+        except ValueError as e:
+            parser.error(str(e))
+    if args.preview:
+        args.scale = args.scale or PREVIEW_SCALE
+        args.profile = args.profile or "draft"
+    job_params = []
+    for scene_name, _ in jobs:
+        if scene_name not in SCENES:
+            parser.error("unknown scene %r, choose from: %s" % (scene_name, ", ".join(sorted(SCENES))))
+        try:
+            job_params.append(scene_params(scene_name, load_scene(scene_name), args.params or []))
+        except ValueError as e:
+            parser.error(str(e))
+        if args.scale is not None:
+            job_params[-1]["scale"] = args.scale
+        if args.fx is not None:
+            job_params[-1]["effects"] = args.fx
+        try:
+            effects = parse_effects(job_params[-1].get("effects", load_scene(scene_name).effects))
+        except ValueError as e:
+            parser.error("%s: %s" % (scene_name, e))
+        if STATEFUL_EFFECTS.intersection(effects) and (args.workers is not None or args.snapshot_every is not None):
+            parser.error("%s: %s need the frames drawn in order, render without --workers and --snapshot-every"
+                         % (scene_name, " and ".join(sorted(STATEFUL_EFFECTS.intersection(effects)))))
+    for key, _ in args.params or []:
+        if "." not in key and not any(key in params for params in job_params):
+            parser.error("no scene in this batch has a parameter %r" % key)
+
+    if args.metrics is not None:
+        for option in ("workers", "snapshot_every"):
+            if getattr(args, option) is not None:
+                parser.error("--metrics times the frame loop of a serial render, it can't be combined with --%s"
+                             % option.replace("_", "-"))
+    if args.cache:
+        if args.seed is None:
+            parser.error("--cache needs --seed, renders are cached per seed")
+        for option in ("frames", "workers", "snapshot_every", "metrics"):
+            if getattr(args, option) is not None:
+                parser.error("--cache can't be combined with --%s" % option.replace("_", "-"))
+    if args.snapshot_every is not None:
+        if args.snapshot_every <= 0:
+            parser.error("--snapshot-every must be positive")
+        if args.frames is not None:
+            parser.error("--frames can't be combined with --snapshot-every")
+        if args.work_dir and len(jobs) > 1:
+            parser.error("--work-dir can only be used with a single scene")
+    elif args.workers is not None:
+        for scene_name, _ in jobs:
+            if not load_scene(scene_name).random_access:
+                parser.error("%s has no random access to its frames, render it with --snapshot-every to use "
+                             "--workers" % scene_name)
+
+    for (scene_name, audio_path), params in zip(jobs, job_params):
+        output = args.output
+        if args.preview and output is None:
+            root, ext = os.path.splitext(load_scene(scene_name).output)
+            output = root + PREVIEW_SUFFIX + ext
+        if args.cache:
+            import render_cache
+
+            render_cache.render_cached(scene_name, audio_path, output=output, seed=args.seed, params=params,
+                                       profile=args.profile, preview_fps=args.preview_fps)
+            continue
+        if args.snapshot_every is not None:
+            import snapshots
+
+            try:
+                snapshots.render_segmented(scene_name, audio_path, output=output, seed=args.seed, params=params,
+                                           workers=args.workers or None, every=args.snapshot_every,
+                                           profile=args.profile, preview_fps=args.preview_fps,
+                                           work_dir=args.work_dir)
+            except ValueError as e:
+                parser.error(str(e))
+            continue
+        if args.workers is not None:
+            import parallel
+
+            try:
+                parallel.render_parallel(scene_name, audio_path, output=output, seed=args.seed, params=params,
+                                         frame_range=args.frames, workers=args.workers or None,
+                                         profile=args.profile, preview_fps=args.preview_fps)
+            except ValueError as e:
+                parser.error(str(e))
+            continue
+        render(scene_name, audio_path, output=output, seed=args.seed, params=params, frame_range=args.frames,
+               profile=args.profile, preview_fps=args.preview_fps, metrics=args.metrics,
+               metrics_interval=args.metrics_interval)
+
+
+if __name__ == "__main__":
+    main()
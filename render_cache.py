@@ -0,0 +1,188 @@
+import fcntl
+import hashlib
+import inspect
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+
+import capture
+import postfx
+from atomic import atomic_write
+from audio import CACHE_DIR, get_audio_duration
+from audio_features import load_features
+from encoder import concat_segments
+from render import encoder_options, frame_step, load_scene
+from scene import Scene
+from snapshots import encode_segment, load_snapshot, save_snapshot, segment_path, snapshot_path
+
+CACHE_VERSION = 1  # Bump to drop every cached render
+RENDER_CACHE_DIR = os.path.join(CACHE_DIR, "renders")
+MAX_CACHE_BYTES = 20 * 1024 ** 3  # Least recently used renders are dropped beyond this
+INDEX = "index.json"
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def local_modules(module):
+    # The module and every module of this package it uses, followed through their names: classes and
+    # functions imported from another module count as that module
+    found = {}
+    stack = [module]
+    while stack:
+        module = stack.pop()
+        path = getattr(module, "__file__", None)
+        if module.__name__ in found or path is None or os.path.dirname(os.path.abspath(path)) != PACKAGE_DIR:
+            continue
+        found[module.__name__] = module
+        for value in vars(module).values():
+            used = value if inspect.ismodule(value) else sys.modules.get(getattr(value, "__module__", None) or "")
+            if used is not None:
+                stack.append(used)
+    return found
+
+
+def code_version(scene_class):
+    # Hash of the source the frames come from: the scene's module and everything of this package it uses, plus
+    # the capture and post-processing stages
+    modules = local_modules(sys.modules[scene_class.__module__])
+    for module in (capture, postfx):
+        modules.update(local_modules(module))
+    digest = hashlib.sha256()
+    for name in sorted(modules):
+        with open(modules[name].__file__, "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extendable(scene):
+    # Frame k is the same however long the render is, unless the scene paces itself to the length (start) or
+    # an effect carries state across frames that a restored snapshot doesn't have
+    return (type(scene).start is Scene.start
+            and not postfx.STATEFUL_EFFECTS.intersection(postfx.parse_effects(scene.effects)))
+
+
+def cache_key(scene_name, scene, seed, params, profile, step, total_frames, audio_path):
+    # Everything the video stream depends on. The soundtrack only matters to scenes that react to it, and the
+    # length only to scenes that can't be extended.
+    options = dict(encoder_options(scene, profile))
+    options.pop("threads", None)  # Sized to the machine, the output doesn't depend on it
+    key = {"version": CACHE_VERSION, "scene": scene_name, "code": code_version(type(scene)), "seed": seed,
+           "params": params, "encoder": options, "step": step}
+    if scene.reactive:
+        key["audio"] = file_digest(audio_path)
+    if not extendable(scene):
+        key["frames"] = total_frames
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:32]
+    return digest, key
+
+
+def load_index(work_dir):
+    try:
+        with open(os.path.join(work_dir, INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_index(work_dir, index):
+    with atomic_write(os.path.join(work_dir, INDEX)) as f:
+        json.dump(index, f)
+
+
+def evict(keep, max_bytes=MAX_CACHE_BYTES):
+    # Drops the least recently used renders until the cache fits, never the one just used or one another job
+    # holds the lock of
+    entries = []
+    for name in os.listdir(RENDER_CACHE_DIR):
+        work_dir = os.path.join(RENDER_CACHE_DIR, name)
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(work_dir))
+            entries.append((os.path.getmtime(os.path.join(work_dir, INDEX)), size, work_dir))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, work_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        if work_dir == keep:
+            continue
+        with open(os.path.join(work_dir, "lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            shutil.rmtree(work_dir, ignore_errors=True)
+        total -= size
+
+
+def render_cached(scene_name, audio_path, output=None, seed=0, params=None, profile=None, preview_fps=None,
+                  max_bytes=MAX_CACHE_BYTES, threads=None):
+    # Renders through a cache of video-only segments keyed by everything the frames depend on. The soundtrack
+    # is muxed in last, so a job that only differs in audio is a remux of the cached stream. A longer job
+    # restores the snapshot taken where the cached frames end and only renders the missing tail.
+    params = params or {}
+    scene_class = load_scene(scene_name)
+    scene = scene_class(**params)  # Only for its settings, the simulation starts from the seed below
+    fps = scene.fps
+    step = frame_step(fps, preview_fps)
+    total_frames = math.ceil(get_audio_duration(audio_path) * fps)
+    output = output or scene.output
+    digest, key = cache_key(scene_name, scene, seed, params, profile, step, total_frames, audio_path)
+    work_dir = os.path.join(RENDER_CACHE_DIR, digest)
+    os.makedirs(work_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    # Concurrent jobs for the same key (one video, several soundtracks) wait for each other instead of
+    # rendering the same frames twice
+    with open(os.path.join(work_dir, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(work_dir)
+        if (index is None or index.get("key") != key
+                or not all(os.path.exists(segment_path(work_dir, start)) for start, _ in index["segments"])):
+            for name in os.listdir(work_dir):
+                if name != "lock":
+                    os.remove(os.path.join(work_dir, name))
+            index = {"key": key, "segments": []}
+        cached = index["segments"][-1][1] if index["segments"] else 0
+
+        if cached < total_frames:
+            if cached:
+                scene = load_snapshot(work_dir, cached, audio_path)
+                print("%s: %d frames cached, rendering frames %d-%d" % (scene_name, cached, cached, total_frames))
+            else:
+                random.seed(seed)
+                scene = scene_class(**params)
+                if scene.reactive:
+                    scene.features = load_features(audio_path, fps)
+                scene.start(total_frames)
+            encode_segment(scene, segment_path(work_dir, cached), cached, total_frames, step, profile, threads)
+            if extendable(scene):
+                save_snapshot(work_dir, scene, total_frames)
+                if cached:
+                    os.remove(snapshot_path(work_dir, cached))  # Only the snapshot at the end is ever restored
+            index["segments"].append([cached, total_frames])
+            save_index(work_dir, index)
+        else:
+            print("%s: all %d frames cached, muxing in %s" % (scene_name, total_frames, audio_path))
+            os.utime(os.path.join(work_dir, INDEX))
+
+        # Segments past the soundtrack aren't needed, the last one used is cut at the end of the audio
+        segments = [segment_path(work_dir, start) for start, _ in index["segments"] if start < total_frames]
+        concat_segments(segments, output, audio_path, scene.encoder_options.get("audio_codec", "aac"))
+
+    evict(work_dir, max_bytes)
+    frames = len(range(0, total_frames, step))
+    print("%s: %d frames in %.1f s from %d cached segments" % (output, frames, time.perf_counter() - started,
+                                                               len(segments)))
+    return frames
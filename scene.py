@@ -0,0 +1,71 @@
+from particles import Particles
+
+SCREEN_WIDTH = 1080  # Resolution for Instagram Reels or YouTube Shorts
+SCREEN_HEIGHT = 1920
+
+
+class Scene:
+    # Base class every animation plugs into: render.py calls start(total_frames) once, then update(dt) and
+    # draw(target) every frame. Class attributes without an underscore are parameters, overridable per render.
+    title = "Animation"
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    fps = 60
+    bg_color = (0, 0, 0)
+    output = "animation_with_audio.mp4"
+    encoder_options = {"codec": "libx264", "audio_codec": "aac"}
+    random_access = False  # seek(frame) puts the scene in its state after frame updates without replaying them
+    antialias = False  # Draw anti-aliased circle sprites
+    reactive = False  # React to the soundtrack, for scenes that support it
+    scale = 1.0  # Drawing scale, the simulation always runs at full size
+    effects = ""  # Post-processing applied to every frame, e.g. "glow,trails" (see postfx.py)
+
+    def __init__(self, **params):
+        for key, value in params.items():
+            if key.startswith("_") or not hasattr(type(self), key):
+                raise ValueError("%s has no parameter %r" % (type(self).__name__, key))
+            setattr(self, key, value)
+        self.features = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["features"] = None  # Memory-mapped from the cache, attached again by the runtime
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restore_sprites()
+
+    def restore_sprites(self):
+        # Particles get their sprites back from the scene's sprite cache after unpickling
+        sprites = self.__dict__.get("sprites")
+        if sprites is None:
+            return
+        for value in self.__dict__.values():
+            if isinstance(value, Particles) and hasattr(value, "sprite"):
+                value.sprite[:] = [sprites.get(int(radius), tuple(color))
+                                   for radius, color in zip(value.radius.tolist(), value.color.tolist())]
+
+    @property
+    def output_size(self):
+        # Size of the frames the scene draws, kept even for the encoder's yuv420p
+        if self.scale == 1:
+            return self.size
+        return tuple(max(2 * round(side * self.scale / 2), 2) for side in self.size)
+
+    def start(self, total_frames):
+        pass
+
+    def update(self, dt):
+        raise NotImplementedError
+
+    def draw(self, target):
+        raise NotImplementedError
+
+    def feature(self, name, frame):
+        # Audio feature at a video frame, zero without features or past the end of the track
+        if self.features is None or not 0 <= frame < len(self.features):
+            return 0
+        return self.features[name][frame]
+
+    def seek(self, frame):
+        raise NotImplementedError("%s can only be advanced one update at a time" % type(self).__name__)
@@ -0,0 +1,193 @@
+import glob
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pygame
+
+from atomic import atomic_write
+from audio import get_audio_duration
+from audio_features import load_features
+from capture import SurfaceCapture
+from encoder import FFmpegWriter, concat_segments
+from postfx import STATEFUL_EFFECTS, parse_effects
+from render import encoder_options, frame_step, load_scene, post_effects
+
+SNAPSHOT_EVERY = 600  # Frames between snapshots, 10 s of video at 60 FPS
+MANIFEST = "manifest.json"
+# Files a render writes into its work dir, with the temp names they are written under. Nothing else there is
+# ever deleted.
+WORK_FILES = re.compile(r"^(snapshot_\d+\.pkl|segment_\d+(\.part)?\.mp4|manifest\.json)((\.[\w-]+)?\.tmp)?$")
+
+
+def snapshot_path(work_dir, frame):
+    return os.path.join(work_dir, "snapshot_%08d.pkl" % frame)
+
+
+def segment_path(work_dir, frame):
+    return os.path.join(work_dir, "segment_%08d.mp4" % frame)
+
+
+def save_snapshot(work_dir, scene, frame):
+    # The scene after `frame` updates, with the random generators' state at that point
+    path = snapshot_path(work_dir, frame)
+    with atomic_write(path, "wb") as f:
+        pickle.dump({"frame": frame, "scene": scene, "random": random.getstate(), "numpy": np.random.get_state()},
+                    f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_snapshot(work_dir, frame, audio_path):
+    # Restores the scene and the random generators, so the updates that follow match an uninterrupted run
+    with open(snapshot_path(work_dir, frame), "rb") as f:
+        snapshot = pickle.load(f)
+    random.setstate(snapshot["random"])
+    np.random.set_state(snapshot["numpy"])
+    scene = snapshot["scene"]
+    if scene.reactive:
+        scene.features = load_features(audio_path, scene.fps)
+    return scene
+
+
+def saved_snapshots(work_dir):
+    return sorted(int(match.group(1)) for match in
+                  (re.search(r"snapshot_(\d+)\.pkl$", path) for path in glob.glob(os.path.join(work_dir, "*.pkl")))
+                  if match)
+
+
+def render_segment(scene_name, audio_path, work_dir, start, end, step, profile):
+    # Runs in a worker: restores the snapshot at `start` and draws and encodes frames start..end-1 into a
+    # video-only segment
+    scene = load_snapshot(work_dir, start, audio_path)
+    encode_segment(scene, segment_path(work_dir, start), start, end, step, profile)
+    return start
+
+
+def encode_segment(scene, path, start, end, step, profile, threads=None):
+    # Advances a scene that has had `start` updates to `end`, drawing and encoding every step-th frame into a
+    # video-only segment at path, renamed into place once it's complete
+    dt = 1 / scene.fps
+    screen = pygame.Surface(scene.output_size, 0, 32)
+    fx = post_effects(scene, screen, step)
+    capture = SurfaceCapture(fx.output if fx else screen)
+    partial = path[:-len(".mp4")] + ".part.mp4"
+    with FFmpegWriter(partial, scene.output_size, scene.fps / step, pix_fmt=capture.pix_fmt,
+                      **encoder_options(scene, profile, threads)) as writer:
+        for frame in range(start, end):
+            scene.update(dt)
+            if frame % step == 0:
+                scene.draw(screen)
+                if fx:
+                    fx.apply(screen)
+                capture.write(writer)
+    os.replace(partial, path)
+
+
+def clear_work_dir(work_dir):
+    # Deletes the snapshots, segments and manifest a render wrote, and the directory if that leaves it empty
+    for name in os.listdir(work_dir):
+        if WORK_FILES.match(name):
+            os.remove(os.path.join(work_dir, name))
+    try:
+        os.rmdir(work_dir)
+    except OSError:
+        pass
+
+
+def prepare_work_dir(work_dir, manifest):
+    # Work left by an interrupted render of the same job is reused, a different render's work is cleared.
+    # A directory with other files in it and no manifest is refused rather than written into.
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        with open(os.path.join(work_dir, MANIFEST)) as f:
+            if json.load(f) == manifest:
+                return True
+        print("%s is from a different render, starting over" % work_dir)
+        clear_work_dir(work_dir)
+    except FileNotFoundError:
+        if os.listdir(work_dir):
+            raise ValueError("%s isn't empty and holds no snapshots of a render, pick another work dir" % work_dir)
+    except ValueError:
+        clear_work_dir(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f)
+    return False
+
+
+def render_segmented(scene_name, audio_path, output=None, seed=None, params=None, workers=None,
+                     every=SNAPSHOT_EVERY, profile=None, preview_fps=None, work_dir=None, keep=False):
+    # Two passes that overlap: this process only simulates, snapshotting the scene every `every` frames, and
+    # each snapshot starts a worker drawing and encoding the segment up to the next one. The segments are then
+    # joined without re-encoding. Finished segments and snapshots survive a crash in work_dir, so running the
+    # same job again resumes where it stopped.
+    params = params or {}
+    scene_class = load_scene(scene_name)
+    scene = scene_class(**params)  # Only for its settings, the simulation starts from the seed below
+    if STATEFUL_EFFECTS.intersection(parse_effects(scene.effects)):
+        raise ValueError("%s can't be rendered in segments with %s, each frame depends on the ones before it"
+                         % (scene_name, scene.effects))
+    fps = scene.fps
+    step = frame_step(fps, preview_fps)
+    every = math.ceil(every / step) * step  # Segments start on drawn frames
+    total_frames = math.ceil(get_audio_duration(audio_path) * fps)
+    output = output or scene.output
+    work_dir = work_dir or output + ".parts"
+
+    manifest = {"scene": scene_name, "audio": os.path.abspath(audio_path), "params": params, "seed": seed,
+                "every": every, "step": step, "profile": profile, "total_frames": total_frames}
+    if prepare_work_dir(work_dir, manifest):
+        print("Resuming %s from %s" % (output, work_dir))
+    starts = list(range(0, total_frames, every))
+    done = {start for start in starts if os.path.exists(segment_path(work_dir, start))}
+    snapshots = [frame for frame in saved_snapshots(work_dir) if frame in starts]
+
+    # Simulation picks up from the latest snapshot, or from scratch
+    if snapshots:
+        frame = snapshots[-1]
+        scene = load_snapshot(work_dir, frame, audio_path)
+    else:
+        if seed is not None:
+            random.seed(seed)
+        frame = 0
+        scene = scene_class(**params)
+        if scene.reactive:
+            scene.features = load_features(audio_path, fps)
+        scene.start(total_frames)
+        save_snapshot(work_dir, scene, 0)
+        snapshots = [0]
+    dt = 1 / fps
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context) as pool:
+        pending = []
+
+        def submit(start):
+            if start not in done:
+                pending.append(pool.submit(render_segment, scene_name, audio_path, work_dir, start,
+                                           min(start + every, total_frames), step, profile))
+
+        for start in snapshots:
+            submit(start)
+        # Snapshots past the last one saved are only needed by segments that haven't been rendered yet
+        last_needed = max((start for start in starts if start not in done), default=0)
+        while frame < last_needed:
+            scene.update(dt)
+            frame += 1
+            if frame % every == 0:
+                save_snapshot(work_dir, scene, frame)
+                submit(frame)
+        for future in pending:
+            future.result()
+
+    concat_segments([segment_path(work_dir, start) for start in starts], output, audio_path,
+                    scene.encoder_options.get("audio_codec", "aac"))
+    if not keep:
+        clear_work_dir(work_dir)
+    print("%s: %d frames joined from %d segments" % (output, len(range(0, total_frames, step)), len(starts)))
+    return len(range(0, total_frames, step))
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Half of the 3x3 neighbourhood: together with the particle's own cell, every pair of
+# neighbouring cells is visited from exactly one side, so each candidate pair comes out once
+HALF_NEIGHBOURHOOD = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+
+class SpatialHash:
+    # Uniform-grid broadphase: with cell_size the interaction distance, only particles in the same or an adjacent
+    # cell can interact
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+
+    def pairs(self, positions):
+        # Returns (first, second) index arrays with every candidate pair exactly once, first != second
+        count = len(positions)
+        empty = np.empty(0, np.int64)
+        if count < 2:
+            return empty, empty
+
+        cells = np.floor(positions / self.cell_size).astype(np.int64)
+        cells -= cells.min(axis=0)
+        # One spare row so offsets at the top or bottom never alias into the neighbouring column
+        rows = cells[:, 1].max() + 2
+        keys = cells[:, 0] * rows + cells[:, 1]
+
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # Pairs inside a cell: each particle with the ones after it in the same bucket
+        firsts, seconds = [empty], [empty]
+        end = np.searchsorted(sorted_keys, sorted_keys, side="right")
+        self._expand(np.arange(count) + 1, end, order, firsts, seconds)
+
+        # Pairs across neighbouring cells
+        for dx, dy in HALF_NEIGHBOURHOOD:
+            neighbour = sorted_keys + (dx * rows + dy)
+            start = np.searchsorted(sorted_keys, neighbour, side="left")
+            end = np.searchsorted(sorted_keys, neighbour, side="right")
+            self._expand(start, end, order, firsts, seconds)
+
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+    @staticmethod
+    def _expand(start, end, order, firsts, seconds):
+        # Sorted slot p is paired with every slot in [start[p], end[p])
+        counts = end - start
+        total = counts.sum()
+        if not total:
+            return
+        slots = np.repeat(np.arange(len(start)), counts)
+        partners = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        firsts.append(order[slots])
+        seconds.append(order[partners])
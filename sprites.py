@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+import pygame.gfxdraw
+
+MAX_SPRITES = 4096  # Cached circles before the least recently used ones are evicted
+
+
+class CircleSprites:
+    # Cache of pre-rasterized circles per (radius, color, width), drawn with one blits call per frame and bounded
+    # by LRU eviction
+    def __init__(self, max_sprites=MAX_SPRITES, antialias=False, scale=1.0):
+        self.max_sprites = max_sprites
+        self.antialias = antialias
+        self.scale = scale
+        self._sprites = OrderedDict()
+
+    def __getstate__(self):
+        # Surfaces can't be pickled, a restored cache starts empty and rasterizes again on demand
+        state = self.__dict__.copy()
+        state["_sprites"] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def get(self, radius, color, width=0):
+        key = (radius, color, width)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            sprite = self._sprites[key] = self._rasterize(radius, color, width)
+            if len(self._sprites) > self.max_sprites:
+                self._sprites.popitem(last=False)
+        else:
+            self._sprites.move_to_end(key)
+        return sprite
+
+    def scaled(self, radius):
+        # Radius (or line width) in target pixels, never below one pixel
+        if self.scale == 1:
+            return radius
+        return max(int(round(radius * self.scale)), 1)
+
+    def _rasterize(self, radius, color, width):
+        radius = self.scaled(radius)
+        width = self.scaled(width) if width else 0
+        size = (2 * radius, 2 * radius)
+        if self.antialias:
+            sprite = pygame.Surface((size[0] + 1, size[1] + 1), pygame.SRCALPHA, 32)
+            if width == 0:
+                pygame.gfxdraw.filled_circle(sprite, radius, radius, radius - 1, color)
+            pygame.gfxdraw.aacircle(sprite, radius, radius, radius - 1, color)
+            return sprite
+
+        sprite = pygame.Surface(size, 0, 32)
+        # Any key that differs from the circle's color works, the sprite only has the two
+        key = (0, 0, 0) if tuple(color[:3]) != (0, 0, 0) else (255, 255, 255)
+        sprite.fill(key)
+        sprite.set_colorkey(key)  # RLEACCEL is slower to blit for sprites this small
+        pygame.draw.circle(sprite, color, (radius, radius), radius, width)
+        return sprite
+
+    def blit_sequence(self, positions, radii, colors, width=0):
+        # positions are integer pixel centers on the target, radii ints and colors RGB tuples, all sequences of
+        # equal length
+        get = self.get
+        scaled = self.scaled
+        return [(get(radius, color, width), (x - scaled(radius), y - scaled(radius)))
+                for (x, y), radius, color in zip(positions, radii, colors)]
+
+    def draw(self, target, positions, radii, colors, width=0):
+        target.blits(self.blit_sequence(positions, radii, colors, width), doreturn=False)
+
+    def sprite_array(self, radius, colors, width=0):
+        # Object array of sprites for a batch of new particles, for their "sprite" field
+        sprites = np.empty(len(colors), object)
+        sprites[:] = [self.get(radius, tuple(color), width) for color in colors]
+        return sprites
+
+    def draw_particles(self, target, particles, width=0, rows=slice(None)):
+        # rows picks the particles to draw, all of them by default
+        radius = particles.radius[rows].astype(np.int64)
+        offset = radius if self.scale == 1 else np.maximum(np.rint(radius * self.scale), 1).astype(np.int64)
+        topleft = particles.pixel_positions(self.scale)[rows] - offset[:, None]
+        # Sprites entirely off the target are skipped, the blit would clip them to nothing
+        target_width, target_height = target.get_size()
+        visible = ((topleft >= -2 * offset[:, None]).all(axis=1)
+                   & (topleft[:, 0] < target_width) & (topleft[:, 1] < target_height))
+        culled = not visible.all()
+        if culled:
+            topleft, radius = topleft[visible], radius[visible]
+        try:
+            sprites = particles.sprite[rows]
+            sprites = (sprites[visible] if culled else sprites).tolist()
+        except AttributeError:
+            get = self.get
+            colors = particles.color[rows][visible] if culled else particles.color[rows]
+            sprites = [get(r, color, width) for r, color in zip(radius.tolist(), map(tuple, colors.tolist()))]
+        target.blits(list(zip(sprites, topleft.tolist())), doreturn=False)
@@ -0,0 +1,121 @@
+import json
+import os
+import resource
+import time
+
+import numpy as np
+
+from atomic import atomic_write
+
+PHASES = ["update", "draw", "capture", "encode"]
+WINDOW = 600  # Frames the rolling percentiles and the ETA are computed over
+INTERVAL = 5.0  # Seconds between metric writes
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+def current_rss():
+    # Resident set size in bytes, from /proc where there is one, otherwise the peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KB on Linux
+
+
+class Telemetry:
+    # Per-phase frame timings, rolling percentiles, ETA and memory of a render, written every interval seconds
+    def __init__(self, path, scene_name, total_frames, interval=INTERVAL, window=WINDOW):
+        self.path = path
+        self.prometheus = path.endswith(".prom")
+        self.scene_name = scene_name
+        self.total_frames = total_frames
+        self.interval = interval
+        self.window = window
+        self.samples = np.zeros((len(PHASES) + 1, window))  # The last row is the whole frame
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.last_write = self.started
+        self._rows = {name: row for row, name in enumerate(PHASES)}
+        self._mark = self._frame_start = self.started
+        if not self.prometheus:
+            open(path, "w").close()
+
+    def begin(self):
+        self.samples[:, self.frames % self.window] = 0  # Phases a frame skips (previews don't draw every frame)
+        self._mark = self._frame_start = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.samples[self._rows[phase], self.frames % self.window] = now - self._mark
+        self._mark = now
+
+    def end(self, encode=0.0):
+        now = time.perf_counter()
+        slot = self.frames % self.window
+        capture = self._rows["capture"]
+        self.samples[capture, slot] = max(self.samples[capture, slot] - encode, 0.0)
+        self.samples[self._rows["encode"], slot] = encode
+        self.samples[-1, slot] = now - self._frame_start
+        self.frames += 1
+        if now - self.last_write >= self.interval:
+            self.write()
+
+    def snapshot(self, done=False):
+        now = time.perf_counter()
+        recent = self.samples[:, :min(self.frames, self.window)]
+        elapsed = now - self.started
+        remaining = max(self.total_frames - self.frames, 0)
+        frame_time = recent[-1].mean() if recent.shape[1] else 0.0
+        rss = current_rss()
+        return {
+            "time": time.time(),
+            "scene": self.scene_name,
+            "frame": self.frames,
+            "total_frames": self.total_frames,
+            "progress": self.frames / self.total_frames if self.total_frames else 1.0,
+            "elapsed_seconds": elapsed,
+            "fps": 1 / frame_time if frame_time else 0.0,
+            "eta_seconds": remaining * frame_time,
+            "rss_bytes": rss,
+            "peak_rss_bytes": max(peak_rss(), rss),
+            "phases": {name: {"mean": float(row.mean()) if len(row) else 0.0,
+                              **{"p%g" % (q * 100): float(np.quantile(row, q)) if len(row) else 0.0
+                                 for q in QUANTILES}}
+                       for name, row in zip(PHASES + ["frame"], recent)},
+            "done": done,
+        }
+
+    def write(self, done=False):
+        self.last_write = time.perf_counter()
+        metrics = self.snapshot(done)
+        if not self.prometheus:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(metrics) + "\n")
+            return
+
+        labels = 'scene="%s"' % self.scene_name
+        lines = []
+
+        def metric(name, kind, help_text, value):
+            lines.extend(["# HELP %s %s" % (name, help_text), "# TYPE %s %s" % (name, kind),
+                          "%s{%s} %r" % (name, labels, float(value))])
+
+        metric("render_frames", "counter", "Frames rendered so far", metrics["frame"])
+        metric("render_frames_planned", "gauge", "Frames the render will produce", metrics["total_frames"])
+        metric("render_fps", "gauge", "Recent frames per second", metrics["fps"])
+        metric("render_eta_seconds", "gauge", "Estimated seconds until the render is done", metrics["eta_seconds"])
+        metric("render_rss_bytes", "gauge", "Resident memory", metrics["rss_bytes"])
+        metric("render_peak_rss_bytes", "gauge", "Peak resident memory", metrics["peak_rss_bytes"])
+        metric("render_done", "gauge", "1 once the render has finished", done)
+        lines += ["# HELP render_phase_seconds Recent per-frame time of each phase",
+                  "# TYPE render_phase_seconds summary"]
+        for name, stats in metrics["phases"].items():
+            for q in QUANTILES:
+                lines.append('render_phase_seconds{%s,phase="%s",quantile="%g"} %r'
+                             % (labels, name, q, stats["p%g" % (q * 100)]))
+        with atomic_write(self.path) as f:
+            f.write("\n".join(lines) + "\n")
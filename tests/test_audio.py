@@ -0,0 +1,106 @@
+import struct
+import wave
+
+import pytest
+
+from audio import read_audio_info
+
+MP3_FRAME = 417  # MPEG-1 layer III, 128 kb/s, 44.1 kHz, no padding
+MP3_HEADER = b"\xff\xfb\x90\x00"  # That frame, stereo
+MP3_SAMPLES = 1152
+
+
+def write_wav(path, seconds, sample_rate=8000, channels=1):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b"\0\0" * channels * int(seconds * sample_rate))
+
+
+def mp3_frame(payload=b""):
+    return (MP3_HEADER + payload).ljust(MP3_FRAME, b"\0")
+
+
+def id3_tag(size):
+    # ID3v2 header with its size as a syncsafe integer, followed by that many bytes of padding
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe + b"\0" * size
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def m4a(sample_rate, media_duration, movie_timescale=1000, edit=None, channels=2):
+    # The boxes read_mp4 needs: mvhd, and an audio trak with mdhd, hdlr, stsd and optionally an edit list
+    mvhd = struct.pack(">4xIIII", 0, 0, movie_timescale, edit or 0) + b"\0" * 80
+    mdhd = struct.pack(">4xIIII", 0, 0, sample_rate, media_duration) + b"\0" * 4
+    hdlr = struct.pack(">4xI4s", 0, b"soun") + b"\0" * 13
+    mp4a = box(b"mp4a", b"\0" * 6 + struct.pack(">H8xHHHHI", 1, channels, 16, 0, 0, sample_rate << 16))
+    stsd = struct.pack(">4xI", 1) + mp4a
+    minf = box(b"minf", box(b"stbl", box(b"stsd", stsd)))
+    trak = box(b"mdia", box(b"mdhd", mdhd) + box(b"hdlr", hdlr) + minf)
+    if edit is not None:
+        # Skips 1024 priming samples and plays `edit` movie ticks
+        trak = box(b"edts", box(b"elst", struct.pack(">4xIIIHH", 1, edit, 1024, 1, 0))) + trak
+    return box(b"ftyp", b"M4A \0\0\0\0") + box(b"moov", box(b"mvhd", mvhd) + box(b"trak", trak))
+
+
+def test_wav(tmp_path):
+    path = tmp_path / "tone.wav"
+    write_wav(path, 1.5, sample_rate=8000, channels=2)
+    assert read_audio_info(str(path)) == (1.5, 8000, 2)
+
+
+def test_streamed_wav_runs_to_the_end_of_the_file(tmp_path):
+    path = tmp_path / "streamed.wav"
+    write_wav(path, 2.0)
+    data = bytearray(path.read_bytes())
+    data[40:44] = b"\xff\xff\xff\xff"  # The data chunk's size, unset by a streaming writer
+    path.write_bytes(bytes(data))
+    assert read_audio_info(str(path)).duration == pytest.approx(2.0)
+
+
+def test_cbr_mp3_counts_frames_after_id3(tmp_path):
+    path = tmp_path / "cbr.mp3"
+    path.write_bytes(id3_tag(300) + mp3_frame() * 50)
+    assert read_audio_info(str(path)) == (50 * MP3_SAMPLES / 44100, 44100, 2)
+
+
+def test_vbr_mp3_xing_with_lame_gapless_info(tmp_path):
+    # Xing header after the 32 bytes of stereo MPEG-1 side info, with the frame count flag only, then LAME's
+    # tag with 576 samples of encoder delay and 1000 of padding
+    delay_padding = (576 << 12) | 1000
+    lame = b"LAME3.100" + b"\0" * 12 + delay_padding.to_bytes(3, "big")
+    xing = b"\0" * 32 + b"Xing" + struct.pack(">II", 1, 1000) + lame
+    path = tmp_path / "vbr.mp3"
+    path.write_bytes(mp3_frame(xing) + mp3_frame() * 3)
+    info = read_audio_info(str(path))
+    assert info.duration == pytest.approx((1000 * MP3_SAMPLES - 1576) / 44100)
+
+
+def test_vbr_mp3_info_without_lame_tag(tmp_path):
+    path = tmp_path / "info.mp3"
+    path.write_bytes(mp3_frame(b"\0" * 32 + b"Info" + struct.pack(">II", 1, 200)) + mp3_frame() * 3)
+    assert read_audio_info(str(path)).duration == pytest.approx(200 * MP3_SAMPLES / 44100)
+
+
+def test_vbr_mp3_vbri(tmp_path):
+    # Fraunhofer's VBRI header sits 32 bytes after the frame header, its frame count at offset 14
+    vbri = b"\0" * 32 + b"VBRI" + b"\0" * 10 + struct.pack(">I", 500)
+    path = tmp_path / "vbri.mp3"
+    path.write_bytes(mp3_frame(vbri) + mp3_frame() * 3)
+    assert read_audio_info(str(path)).duration == pytest.approx(500 * MP3_SAMPLES / 44100)
+
+
+def test_m4a_without_edit_list_uses_the_media_duration(tmp_path):
+    path = tmp_path / "plain.m4a"
+    path.write_bytes(m4a(44100, 88200 + 1024))
+    assert read_audio_info(str(path)) == ((88200 + 1024) / 44100, 44100, 2)
+
+
+def test_m4a_edit_list_trims_the_priming_samples(tmp_path):
+    path = tmp_path / "edited.m4a"
+    path.write_bytes(m4a(48000, 96000 + 1024, movie_timescale=1000, edit=2000, channels=1))
+    assert read_audio_info(str(path)) == (2.0, 48000, 1)
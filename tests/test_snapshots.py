@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pygame
+import pytest
+
+from render import load_scene
+from snapshots import clear_work_dir, load_snapshot, prepare_work_dir, save_snapshot, snapshot_path
+
+FRAMES = 120
+SNAPSHOT_AT = 70
+
+
+def start_scene(scene_name, seed=3):
+    random.seed(seed)
+    np.random.seed(seed)
+    scene = load_scene(scene_name)(scale=0.25)
+    scene.start(FRAMES)
+    return scene
+
+
+def drawn(scene):
+    surface = pygame.Surface(scene.output_size, 0, 32)
+    scene.draw(surface)
+    return pygame.image.tobytes(surface, "RGBX")
+
+
+@pytest.mark.parametrize("scene_name", ["multiplying_balls", "falling_balls", "fireflies", "molecules",
+                                        "repulsing_balls", "galaxy", "maze"])
+def test_restored_snapshot_continues_like_a_straight_render(tmp_path, scene_name):
+    scene = start_scene(scene_name)
+    for _ in range(FRAMES):
+        scene.update(1 / scene.fps)
+    expected = drawn(scene)
+
+    scene = start_scene(scene_name)
+    for _ in range(SNAPSHOT_AT):
+        scene.update(1 / scene.fps)
+    drawn(scene)  # Drawing before the snapshot, like a render does, must not change what comes after
+    save_snapshot(str(tmp_path), scene, SNAPSHOT_AT)
+    del scene
+    random.seed(99)  # Whatever the worker's generators were doing before, the snapshot brings them back
+    np.random.seed(99)
+
+    scene = load_snapshot(str(tmp_path), SNAPSHOT_AT, None)
+    for _ in range(FRAMES - SNAPSHOT_AT):
+        scene.update(1 / scene.fps)
+    assert drawn(scene) == expected
+
+
+def test_work_dir_only_clears_its_own_files(tmp_path):
+    work_dir = str(tmp_path)
+    assert not prepare_work_dir(work_dir, {"scene": "galaxy", "seed": 1})
+    save_snapshot(work_dir, start_scene("galaxy"), 0)
+    assert prepare_work_dir(work_dir, {"scene": "galaxy", "seed": 1})  # Same render, its work is reused
+
+    (tmp_path / "notes.txt").write_text("keep me")
+    assert not prepare_work_dir(work_dir, {"scene": "galaxy", "seed": 2})
+    assert not (tmp_path / snapshot_path("", 0)).exists()
+    assert (tmp_path / "notes.txt").read_text() == "keep me"
+
+    clear_work_dir(work_dir)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["notes.txt"]
+
+
+def test_work_dir_with_unrelated_files_is_refused(tmp_path):
+    (tmp_path / "photo.jpg").write_bytes(b"")
+    with pytest.raises(ValueError):
+        prepare_work_dir(str(tmp_path), {"scene": "galaxy", "seed": 1})
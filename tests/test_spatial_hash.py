@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from spatial_hash import SpatialHash
+
+
+def close_pairs(positions, distance):
+    # Brute force: every pair closer than distance, as (smaller index, larger index)
+    gaps = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+    first, second = np.nonzero(np.triu(gaps < distance, 1))
+    return set(zip(first.tolist(), second.tolist()))
+
+
+def candidate_pairs(positions, cell_size):
+    first, second = SpatialHash(cell_size).pairs(positions)
+    assert not np.any(first == second)
+    pairs = [(min(a, b), max(a, b)) for a, b in zip(first.tolist(), second.tolist())]
+    assert len(pairs) == len(set(pairs)), "a candidate pair came out twice"
+    return set(pairs)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_finds_every_close_pair(seed):
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-300, 1100, (400, 2))
+    assert close_pairs(positions, 40) <= candidate_pairs(positions, 40)
+
+
+def test_candidates_are_only_neighbouring_cells():
+    rng = np.random.default_rng(7)
+    positions = rng.uniform(0, 1000, (300, 2))
+    cells = np.floor(positions / 50)
+    for a, b in candidate_pairs(positions, 50):
+        assert np.abs(cells[a] - cells[b]).max() <= 1
+
+
+def test_clustered_and_edge_positions():
+    # Everything in one cell, on cell borders, and at the grid's top and bottom rows, where a neighbour offset
+    # could alias into the next column
+    positions = np.array([[0, 0], [0, 0], [10, 10], [20, 0], [20, 19.9], [0, 19.9], [40, 0], [39.9, 39.9],
+                          [60, 0], [59.9, 79.9], [80, 80]], np.float64)
+    assert close_pairs(positions, 20) <= candidate_pairs(positions, 20)
+
+
+def test_fewer_than_two_particles():
+    for count in (0, 1):
+        first, second = SpatialHash(10).pairs(np.zeros((count, 2)))
+        assert len(first) == len(second) == 0